@@ -1,10 +1,14 @@
 import os
+import hmac
+import math
 import logging
 import asyncio
 from aiohttp import web
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import CommandStart, Command
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
 
@@ -25,12 +29,22 @@ BOTHOST_APP_ID = os.getenv("BOTHOST_APP_ID", "bot_1763602889_6267_eaglestar")
 WEBHOOK_PATH = "/webhook"
 WEBHOOK_URL = f"https://{BOTHOST_APP_ID}.bothost.ru{WEBHOOK_PATH}"
 
+# Токен для админских эндпоинтов (профилирование); без него эндпоинты отключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Адрес Bot API (например, локальный telegram-bot-api); по умолчанию - api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
 dp = Dispatcher(storage=MemoryStorage())
 
 # Импортируем роутеры
 from handlers.user_handlers import user_router
+from services.profiler import ProfilerSession
+
+profiler = ProfilerSession(dp)
 
 
 # Обработчики команд
@@ -42,14 +56,15 @@ async def cmd_start(message: types.Message):
         logger.info(f"🎯 /start от {user.id} ({user.first_name})")
 
         from database.db import add_subscriber, add_scheduled_message, WELCOME_MESSAGES
+        from services.welcome import WELCOME_TEMPLATES
 
         # Добавляем пользователя в базу
         await add_subscriber(user.id, user.username or "No username", user.first_name or "No name")
         logger.info(f"✅ Пользователь {user.id} добавлен в БД")
 
         # Отправляем первое сообщение сразу
-        first_message = WELCOME_MESSAGES[0]
-        await message.answer(first_message["text"])
+        first_message = WELCOME_TEMPLATES[0].render({"first_name": user.first_name, "username": user.username})
+        await message.answer(first_message, parse_mode=ParseMode.HTML)
 
         # Планируем остальные сообщения
         for i, msg_data in enumerate(WELCOME_MESSAGES[1:], 1):
@@ -82,13 +97,48 @@ async def handle_other_messages(message: types.Message):
     await message.answer("Используйте /start для подписки или /help для справки")
 
 
+async def init_database():
+    """Инициализация базы данных"""
+    from database.db import create_table
+    await create_table()
+    logger.info("✅ База данных инициализирована")
+
+
+def start_scheduler():
+    """Запуск планировщика (общий для режимов webhook и polling)"""
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from scheduler.tasks import send_scheduled_welcome
+    from database.db import cleanup_old_messages
+
+    scheduler = AsyncIOScheduler()
+
+    # Задача для приветственных сообщений (каждые 2 минуты)
+    scheduler.add_job(
+        send_scheduled_welcome,
+        'interval',
+        minutes=2,
+        args=[bot],
+        id='welcome_messages'
+    )
+
+    # Задача для очистки старых сообщений (раз в день)
+    scheduler.add_job(
+        cleanup_old_messages,
+        'interval',
+        hours=24,
+        id='cleanup'
+    )
+
+    scheduler.start()
+    logger.info("✅ Планировщик запущен")
+    return scheduler
+
+
 async def on_startup(app):
     """Действия при запуске приложения"""
     try:
         # Инициализируем базу данных
-        from database.db import create_table
-        await create_table()
-        logger.info("✅ База данных инициализирована")
+        await init_database()
 
         # Устанавливаем вебхук для Bothost.ru
         await bot.set_webhook(
@@ -98,31 +148,7 @@ async def on_startup(app):
         logger.info(f"✅ Вебхук установлен для Bothost.ru: {WEBHOOK_URL}")
 
         # Запускаем планировщик
-        from apscheduler.schedulers.asyncio import AsyncIOScheduler
-        from scheduler.tasks import send_scheduled_welcome
-        from database.db import cleanup_old_messages
-
-        scheduler = AsyncIOScheduler()
-
-        # Задача для приветственных сообщений (каждые 2 минуты)
-        scheduler.add_job(
-            send_scheduled_welcome,
-            'interval',
-            minutes=2,
-            args=[bot],
-            id='welcome_messages'
-        )
-
-        # Задача для очистки старых сообщений (раз в день)
-        scheduler.add_job(
-            cleanup_old_messages,
-            'interval',
-            hours=24,
-            id='cleanup'
-        )
-
-        scheduler.start()
-        logger.info("✅ Планировщик запущен")
+        start_scheduler()
 
     except Exception as e:
         logger.error(f"❌ Ошибка при запуске: {e}")
@@ -156,10 +182,52 @@ async def webhook_handler(request):
         return web.Response(status=500, text="Internal Server Error")
 
 
+async def profile_handler(request):
+    """Запуск ограниченной по времени сессии профилирования.
+
+    Параметры запроса: mode=stacks|cprofile, seconds, interval (для stacks),
+    sample_rate и format=text|raw (для cprofile).
+    """
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return web.Response(status=403, text="Forbidden")
+
+    query = request.query
+    try:
+        mode = query.get("mode", "stacks")
+        seconds = float(query.get("seconds", 10))
+        interval = float(query.get("interval", 0.005))
+        sample_rate = float(query.get("sample_rate", 0.1))
+        raw = query.get("format", "text") == "raw"
+    except ValueError:
+        return web.Response(status=400, text="Некорректные параметры")
+    # float() принимает nan и inf, а asyncio.sleep(nan) не завершается никогда
+    if not all(math.isfinite(value) for value in (seconds, interval, sample_rate)):
+        return web.Response(status=400, text="Некорректные параметры")
+
+    logger.info(f"🔬 Профилирование: mode={mode}, seconds={seconds}")
+    try:
+        result = await profiler.run(mode, seconds, interval, sample_rate, raw)
+    except RuntimeError as e:
+        return web.Response(status=409, text=str(e))
+    except ValueError as e:
+        return web.Response(status=400, text=str(e))
+
+    if isinstance(result, bytes):
+        return web.Response(body=result, content_type="application/octet-stream",
+                            headers={"Content-Disposition": "attachment; filename=profile.pstats"})
+    return web.Response(text=result)
+
+
+def setup_dispatcher():
+    """Регистрация роутеров в диспетчере"""
+    dp.include_router(user_router)
+
+
 def main():
     """Основная функция инициализации"""
     # Регистрируем роутеры
-    dp.include_router(user_router)
+    setup_dispatcher()
 
     # Создаем aiohttp приложение
     app = web.Application()
@@ -171,6 +239,9 @@ def main():
     # Регистрируем вебхук
     app.router.add_post(WEBHOOK_PATH, webhook_handler)
 
+    # Профилирование (только с заголовком X-Admin-Token)
+    app.router.add_post('/admin/profile', profile_handler)
+
     # Регистрируем startup/shutdown
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
@@ -0,0 +1,63 @@
+import html
+import random
+import sys
+import os
+import timeit
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.templates import compile_template
+
+TEXT = """🔥 <b>{first_name|Друг}, новый курс по Machine Learning!</b>
+
+Ваш промокод: <code>{promo_code|ML2024}</code>
+
+🎯 Что вы получите:
+• Практические навыки ML
+• Реальные проекты в портфолио
+• Поддержку ментора
+• Сертификат о завершении"""
+
+NAIVE_TEXT = TEXT.replace("{first_name|Друг}", "{first_name}").replace("{promo_code|ML2024}", "{promo_code}")
+
+RECIPIENTS = 100_000
+
+
+def make_contexts(distinct_names: int):
+    """Получатели: имена из ограниченного набора, промокод - у каждого десятого"""
+    names = [f"Имя{i} <&>" for i in range(distinct_names)]
+    return [
+        {"first_name": random.choice(names), "promo_code": "VIP10" if i % 10 == 0 else None}
+        for i in range(RECIPIENTS)
+    ]
+
+
+def naive(contexts):
+    for ctx in contexts:
+        NAIVE_TEXT.format(
+            first_name=html.escape(ctx["first_name"] or "Друг", quote=False),
+            promo_code=html.escape(ctx["promo_code"] or "ML2024", quote=False),
+        )
+
+
+def compiled(template, contexts):
+    render = template.render
+    for ctx in contexts:
+        render(ctx)
+
+
+def report(name: str, seconds: float):
+    print(f"{name:<40} {seconds * 1e9 / RECIPIENTS:8.0f} нс/получатель")
+
+
+if __name__ == "__main__":
+    print(f"Рендер текста для {RECIPIENTS} получателей\n")
+    for distinct in (100, RECIPIENTS):
+        contexts = make_contexts(distinct)
+        print(f"Различных имён: {distinct}")
+        report("  str.format + html.escape", min(timeit.repeat(lambda: naive(contexts), number=1, repeat=3)))
+        report("  компилированный, без кэша",
+               min(timeit.repeat(lambda: compiled(compile_template(TEXT, cache_size=0), contexts), number=1, repeat=3)))
+        report("  компилированный, с кэшем",
+               min(timeit.repeat(lambda: compiled(compile_template(TEXT, cache_size=4096), contexts), number=1, repeat=3)))
+        compile_template.cache_clear()
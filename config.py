@@ -15,4 +15,15 @@ WEBHOOK_PATH = "/webhook"
 WEBHOOK_URL = f"https://{BOTHOST_APP_ID}.bothost.ru{WEBHOOK_PATH}"
 
 # Отключаем само-пинг для Bothost.ru
-SELF_PING_ENABLED = False
\ No newline at end of file
+SELF_PING_ENABLED = False
+
+# Хранилище: sqlite (один файл), memory (в памяти процесса) или sharded (N файлов SQLite)
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "sqlite")
+DB_PATH = os.getenv("DB_PATH", "subscribers.db")
+DB_SHARDS = int(os.getenv("DB_SHARDS", "4"))
+
+# Режим long polling (polling.py)
+POLLING_STATE_PATH = os.getenv("POLLING_STATE_PATH", "polling_state.db")
+POLLING_LIMIT = int(os.getenv("POLLING_LIMIT", "100"))
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "50"))
+POLLING_MAX_IN_FLIGHT = int(os.getenv("POLLING_MAX_IN_FLIGHT", "1000"))
@@ -1,6 +1,7 @@
-import aiosqlite
 import logging
-from typing import List
+from typing import Optional
+
+from database.storage import Storage, create_storage
 
 logger = logging.getLogger(__name__)
 
@@ -8,7 +9,7 @@ logger = logging.getLogger(__name__)
 WELCOME_MESSAGES = [
     {
         "delay_minutes": 0,  # Сразу после /start
-        "text": "👋 Добро пожаловать в IT Courses Bot!\n\nЯ буду присылать вам лучшие курсы по программированию и ИИ. Оставайтесь на связи! 🚀",
+        "text": "👋 {first_name|Привет}, добро пожаловать в IT Courses Bot!\n\nЯ буду присылать вам лучшие курсы по программированию и ИИ. Оставайтесь на связи! 🚀",
         "image": None
     },
     {
@@ -27,145 +28,223 @@ WELCOME_MESSAGES = [
     },
     {
         "delay_minutes": 60 * 24 * 3,  # Через 3 дня
-        "text": "🚀 Специальное предложение!\n\nПолучите скидку 20% на все наши курсы по промокоду WELCOME20!\nНе упустите шанс начать карьеру в IT!",
+        "text": "🚀 Специальное предложение!\n\nПолучите скидку 20% на все наши курсы по промокоду {promo_code|WELCOME20}!\nНе упустите шанс начать карьеру в IT!",
         "image": None,
         "button_text": "Получить скидку",
         "button_url": "https://example.com/special-offer"
     }
 ]
 
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """Текущий движок хранилища (по умолчанию - из config.py)"""
+    global _storage
+    if _storage is None:
+        from config import STORAGE_ENGINE, DB_PATH, DB_SHARDS
+        _storage = create_storage(STORAGE_ENGINE, DB_PATH, DB_SHARDS)
+        logger.info(f"Движок хранилища: {STORAGE_ENGINE}")
+    return _storage
+
+
+def set_storage(storage: Storage):
+    """Подмена движка хранилища (для тестов и бенчмарков)"""
+    global _storage
+    _storage = storage
+
 
 async def create_table():
     """Создание таблиц базы данных с поддержкой миграций"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        # Включаем поддержку внешних ключей
-        await db.execute("PRAGMA foreign_keys = ON")
-
-        # Создаем таблицу подписчиков
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS subscribers (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                welcome_stage INTEGER DEFAULT 0
-            )
-        ''')
-
-        # Создаем таблицу для отслеживания отправленных сообщений
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS scheduled_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                message_stage INTEGER,
-                scheduled_for TIMESTAMP,
-                sent BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES subscribers (user_id) ON DELETE CASCADE
-            )
-        ''')
-
-        # ✅ МИГРАЦИЯ: Добавляем столбец welcome_stage если его нет
-        try:
-            await db.execute("ALTER TABLE subscribers ADD COLUMN welcome_stage INTEGER DEFAULT 0")
-            logger.info("Миграция: добавлен столбец welcome_stage")
-        except aiosqlite.OperationalError:
-            # Столбец уже существует - это нормально
-            pass
-
-        await db.commit()
-        logger.info("База данных инициализирована")
+    await get_storage().connect()
+    logger.info("База данных инициализирована")
 
 
 async def add_subscriber(user_id: int, username: str, first_name: str):
     """Добавление нового подписчика"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        await db.execute(
-            """INSERT OR REPLACE INTO subscribers 
-               (user_id, username, first_name, subscribed_at, welcome_stage) 
-               VALUES (?, ?, ?, datetime('now'), 0)""",
-            (user_id, username, first_name)
-        )
-        await db.commit()
+    await get_storage().add_subscriber(user_id, username, first_name)
     logger.info(f"Добавлен подписчик: {user_id}")
 
 
 async def get_all_subscribers():
     """Получение всех подписчиков"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        cursor = await db.execute("SELECT user_id FROM subscribers")
-        rows = await cursor.fetchall()
-        return [row[0] for row in rows]
+    return await get_storage().get_all_subscribers()
+
+
+async def iter_subscribers(batch_size: int = 1000):
+    """Потоковое чтение всех подписчиков пачками user_id по возрастанию"""
+    storage = get_storage()
+    after_user_id = 0
+    while True:
+        batch = await storage.get_subscribers_batch(after_user_id, batch_size)
+        if not batch:
+            return
+        yield batch
+        after_user_id = batch[-1]
 
 
 async def get_subscribers_for_welcome():
     """Получение подписчиков, которым нужно отправить приветственные сообщения"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        cursor = await db.execute('''
-            SELECT s.user_id, s.welcome_stage, s.subscribed_at
-            FROM subscribers s
-            WHERE s.welcome_stage < ?
-        ''', (len(WELCOME_MESSAGES),))
-        rows = await cursor.fetchall()
-        return rows
+    return await get_storage().get_subscribers_for_welcome(len(WELCOME_MESSAGES))
+
+
+async def get_subscriber_profiles(user_ids):
+    """Данные для персонализации: {user_id: {first_name, username, stage, promo_code}}"""
+    rows = await get_storage().get_subscriber_profiles(list(user_ids))
+    return {
+        user_id: {
+            # Заглушки из add_subscriber не подставляем в текст
+            "first_name": first_name if first_name != "No name" else None,
+            "username": username if username != "No username" else None,
+            "stage": stage,
+            "promo_code": promo_code,
+        }
+        for user_id, username, first_name, stage, promo_code in rows
+    }
 
 
 async def update_welcome_stage(user_id: int, new_stage: int):
     """Обновление стадии приветственных сообщений"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        await db.execute(
-            "UPDATE subscribers SET welcome_stage = ? WHERE user_id = ?",
-            (new_stage, user_id)
-        )
-        await db.commit()
+    await get_storage().update_welcome_stage(user_id, new_stage)
     logger.debug(f"Обновлена стадия welcome_stage для {user_id}: {new_stage}")
 
 
+async def add_tag(user_id: int, tag: str):
+    """Добавление тега подписчику"""
+    await get_storage().add_tag(user_id, tag)
+    logger.debug(f"Подписчику {user_id} добавлен тег {tag}")
+
+
+async def remove_tag(user_id: int, tag: str):
+    """Удаление тега у подписчика"""
+    await get_storage().remove_tag(user_id, tag)
+    logger.debug(f"У подписчика {user_id} удален тег {tag}")
+
+
+async def set_attribute(user_id: int, key: str, value):
+    """Установка атрибута подписчика (None - удаление)"""
+    await get_storage().set_attribute(user_id, key, value)
+    logger.debug(f"Подписчику {user_id} установлен атрибут {key}={value}")
+
+
 async def add_scheduled_message(user_id: int, message_stage: int, delay_minutes: int):
     """Добавление запланированного сообщения"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        # Используем SQLite datetime функцию для вычисления времени
-        scheduled_for = f"datetime('now', '+{delay_minutes} minutes')"
-        await db.execute(
-            f"""INSERT INTO scheduled_messages 
-                (user_id, message_stage, scheduled_for) 
-                VALUES (?, ?, {scheduled_for})""",
-            (user_id, message_stage)
-        )
-        await db.commit()
+    await get_storage().add_scheduled_message(user_id, message_stage, delay_minutes)
     logger.debug(f"Добавлено запланированное сообщение для {user_id}, стадия {message_stage}")
 
 
 async def get_pending_messages():
     """Получение сообщений, готовых к отправке"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        cursor = await db.execute('''
-            SELECT sm.id, sm.user_id, sm.message_stage, s.username
-            FROM scheduled_messages sm
-            JOIN subscribers s ON sm.user_id = s.user_id
-            WHERE sm.sent = FALSE AND sm.scheduled_for <= datetime('now')
-            ORDER BY sm.scheduled_for ASC
-        ''')
-        rows = await cursor.fetchall()
-        return rows
+    return await get_storage().get_pending_messages()
 
 
 async def mark_message_sent(message_id: int):
     """Отметка сообщения как отправленного"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        await db.execute(
-            "UPDATE scheduled_messages SET sent = TRUE WHERE id = ?",
-            (message_id,)
-        )
-        await db.commit()
+    await get_storage().mark_message_sent(message_id)
     logger.debug(f"Отмечено сообщение {message_id} как отправленное")
 
 
 async def cleanup_old_messages():
     """Очистка старых отправленных сообщений (чтобы база не росла бесконечно)"""
-    async with aiosqlite.connect('subscribers.db') as db:
-        await db.execute(
-            "DELETE FROM scheduled_messages WHERE sent = TRUE AND created_at < datetime('now', '-7 days')"
-        )
-        await db.commit()
-    logger.info("Очищены старые отправленные сообщения")
\ No newline at end of file
+    await get_storage().cleanup_old_messages()
+    logger.info("Очищены старые отправленные сообщения")
+
+
+async def create_campaign(text: str, image_url: Optional[str] = None,
+                          button_url: Optional[str] = None, button_text: Optional[str] = None) -> int:
+    """Создание записи о рассылке"""
+    campaign_id = await get_storage().create_campaign(text, image_url, button_url, button_text)
+    logger.info(f"Создана рассылка {campaign_id}")
+    return campaign_id
+
+
+async def finish_campaign(campaign_id: int, sent_count: int):
+    """Фиксация числа отправленных сообщений рассылки"""
+    await get_storage().finish_campaign(campaign_id, sent_count)
+    logger.debug(f"Рассылка {campaign_id}: отправлено {sent_count} сообщений")
+
+
+async def update_campaign(campaign_id: int, text: str, button_url: Optional[str], button_text: Optional[str]):
+    """Сохранение нового текста и кнопки рассылки после исправления"""
+    await get_storage().update_campaign(campaign_id, text, button_url, button_text)
+
+
+async def get_campaign(campaign_id: int):
+    """Получение записи о рассылке"""
+    return await get_storage().get_campaign(campaign_id)
+
+
+async def add_campaign_messages(campaign_id: int, messages):
+    """Пакетная запись отправленных сообщений рассылки: [(chat_id, message_id), ...]"""
+    if messages:
+        await get_storage().add_campaign_messages(campaign_id, list(messages))
+
+
+async def delete_campaign_messages(campaign_id: int, chat_ids):
+    """Удаление записей об отозванных сообщениях рассылки"""
+    if chat_ids:
+        await get_storage().delete_campaign_messages(campaign_id, list(chat_ids))
+
+
+async def iter_campaign_messages(campaign_id: int, batch_size: int = 1000):
+    """Потоковое чтение отправленных сообщений рассылки пачками (chat_id, message_id)"""
+    storage = get_storage()
+    after_chat_id = 0
+    while True:
+        batch = await storage.get_campaign_messages(campaign_id, after_chat_id, batch_size)
+        if not batch:
+            return
+        yield batch
+        after_chat_id = batch[-1][0]
+
+
+async def get_sent_chat_ids(campaign_id: int, user_ids) -> set:
+    """Какие из user_ids (по возрастанию) уже получили сообщение рассылки"""
+    if not user_ids:
+        return set()
+    storage = get_storage()
+    wanted = set(user_ids)
+    sent = set()
+    after_chat_id = user_ids[0] - 1
+    while after_chat_id < user_ids[-1]:
+        batch = await storage.get_campaign_messages(campaign_id, after_chat_id, len(user_ids))
+        if not batch:
+            break
+        sent.update(chat_id for chat_id, _ in batch if chat_id in wanted)
+        after_chat_id = batch[-1][0]
+    return sent
+
+
+async def create_segment_snapshot(query: str) -> int:
+    """Материализация сегмента аудитории по запросу (см. database.segments)"""
+    storage = get_storage()
+    snapshot_id = await storage.create_segment_snapshot(query)
+    snapshot = await storage.get_segment_snapshot(snapshot_id)
+    logger.info(f"Снимок сегмента {snapshot_id} ({query!r}): {snapshot[2]} получателей")
+    return snapshot_id
+
+
+async def get_segment_snapshot(snapshot_id: int):
+    """Получение снимка сегмента: (id, query, size, cursor)"""
+    return await get_storage().get_segment_snapshot(snapshot_id)
+
+
+async def update_segment_cursor(snapshot_id: int, cursor: int):
+    """Сохранение позиции обхода снимка"""
+    await get_storage().update_segment_cursor(snapshot_id, cursor)
+
+
+async def iter_segment(snapshot_id: int, batch_size: int = 1000):
+    """Потоковое чтение снимка пачками user_id, начиная с сохранённого курсора"""
+    storage = get_storage()
+    snapshot = await storage.get_segment_snapshot(snapshot_id)
+    if snapshot is None:
+        raise ValueError(f"Снимок сегмента {snapshot_id} не найден")
+
+    after_user_id = snapshot[3]
+    while True:
+        batch = await storage.get_segment_batch(snapshot_id, after_user_id, batch_size)
+        if not batch:
+            return
+        yield batch
+        after_user_id = batch[-1]
@@ -0,0 +1,247 @@
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import List, Optional, Tuple
+
+from database.segments import compile_predicate, normalize_attribute_value, parse_segment
+from database.storage import Storage
+
+CLEANUP_AGE_SECONDS = 7 * 24 * 60 * 60
+
+
+def _format_ts(ts: float) -> str:
+    """Формат времени как у datetime('now') в SQLite"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+
+class MemoryStorage(Storage):
+    """Хранилище в памяти процесса для тестов и бенчмарков.
+
+    Данные лежат колонками в array: числовые поля занимают по 8 байт на
+    запись вместо отдельного объекта-строки на каждую запись.
+    """
+
+    def __init__(self):
+        # Подписчики: колонка на поле + индекс user_id -> позиция
+        self._sub_index = {}
+        self._sub_ids = array('q')
+        self._sub_stage = array('q')
+        self._sub_time = array('d')
+        self._sub_username = []
+        self._sub_first_name = []
+        # Отсортированные user_id для постраничного обхода
+        self._sub_sorted = array('q')
+
+        # Теги и атрибуты: user_id -> {key: set(values)}
+        self._attributes = {}
+
+        # Запланированные сообщения: id строго возрастают, поиск через bisect
+        self._next_msg_id = 1
+        self._msg_ids = array('q')
+        self._msg_user = array('q')
+        self._msg_stage = array('q')
+        self._msg_due = array('d')
+        self._msg_created = array('d')
+        self._msg_sent = array('b')
+
+        # Рассылки: id = позиция + 1
+        self._campaigns = []
+        # Отправленные сообщения рассылок: campaign_id -> [chat_ids, message_ids, отсортировано]
+        self._campaign_messages = {}
+
+        # Снимки сегментов: id = позиция + 1, участники - отсортированный array
+        self._snapshots = []
+
+    # --- Подписчики ---
+
+    async def add_subscriber(self, user_id: int, username: str, first_name: str):
+        now = time.time()
+        pos = self._sub_index.get(user_id)
+        if pos is None:
+            self._sub_index[user_id] = len(self._sub_ids)
+            self._sub_ids.append(user_id)
+            self._sub_stage.append(0)
+            self._sub_time.append(now)
+            self._sub_username.append(username)
+            self._sub_first_name.append(first_name)
+            insort(self._sub_sorted, user_id)
+        else:
+            self._sub_stage[pos] = 0
+            self._sub_time[pos] = now
+            self._sub_username[pos] = username
+            self._sub_first_name[pos] = first_name
+
+    async def get_all_subscribers(self) -> List[int]:
+        return self._sub_ids.tolist()
+
+    async def get_subscribers_batch(self, after_user_id: int, limit: int) -> List[int]:
+        start = bisect_right(self._sub_sorted, after_user_id)
+        return self._sub_sorted[start:start + limit].tolist()
+
+    async def get_subscribers_for_welcome(self, max_stage: int) -> List[Tuple]:
+        return [
+            (self._sub_ids[i], stage, _format_ts(self._sub_time[i]))
+            for i, stage in enumerate(self._sub_stage)
+            if stage < max_stage
+        ]
+
+    async def get_subscriber_profiles(self, user_ids: List[int]) -> List[Tuple]:
+        rows = []
+        for user_id in user_ids:
+            pos = self._sub_index.get(user_id)
+            if pos is None:
+                continue
+            promo_codes = self._attributes.get(user_id, {}).get('promo_code')
+            rows.append((user_id, self._sub_username[pos], self._sub_first_name[pos], self._sub_stage[pos],
+                         next(iter(promo_codes)) if promo_codes else None))
+        return rows
+
+    async def update_welcome_stage(self, user_id: int, new_stage: int):
+        pos = self._sub_index.get(user_id)
+        if pos is not None:
+            self._sub_stage[pos] = new_stage
+
+    # --- Теги и атрибуты подписчиков ---
+
+    async def add_tag(self, user_id: int, tag: str):
+        self._attributes.setdefault(user_id, {}).setdefault('tag', set()).add(str(tag))
+
+    async def remove_tag(self, user_id: int, tag: str):
+        self._attributes.get(user_id, {}).get('tag', set()).discard(str(tag))
+
+    async def set_attribute(self, user_id: int, key: str, value):
+        attrs = self._attributes.setdefault(user_id, {})
+        if value is None:
+            attrs.pop(key, None)
+        else:
+            attrs[key] = {normalize_attribute_value(value)}
+
+    # --- Запланированные сообщения ---
+
+    async def add_scheduled_message(self, user_id: int, message_stage: int, delay_minutes: int):
+        now = time.time()
+        self._msg_ids.append(self._next_msg_id)
+        self._msg_user.append(user_id)
+        self._msg_stage.append(message_stage)
+        self._msg_due.append(now + delay_minutes * 60)
+        self._msg_created.append(now)
+        self._msg_sent.append(0)
+        self._next_msg_id += 1
+
+    async def get_pending_messages(self) -> List[Tuple]:
+        now = time.time()
+        rows = []
+        for i, sent in enumerate(self._msg_sent):
+            if sent or self._msg_due[i] > now:
+                continue
+            user_id = self._msg_user[i]
+            # Аналог JOIN: пропускаем сообщения без подписчика
+            pos = self._sub_index.get(user_id)
+            if pos is None:
+                continue
+            rows.append((self._msg_due[i], self._msg_ids[i], user_id,
+                         self._msg_stage[i], self._sub_username[pos]))
+        rows.sort(key=lambda row: row[0])
+        return [row[1:] for row in rows]
+
+    async def mark_message_sent(self, message_id: int):
+        pos = bisect_left(self._msg_ids, message_id)
+        if pos < len(self._msg_ids) and self._msg_ids[pos] == message_id:
+            self._msg_sent[pos] = 1
+
+    async def cleanup_old_messages(self):
+        border = time.time() - CLEANUP_AGE_SECONDS
+        keep = [
+            i for i, sent in enumerate(self._msg_sent)
+            if not (sent and self._msg_created[i] < border)
+        ]
+        if len(keep) == len(self._msg_ids):
+            return
+        for name in ('_msg_ids', '_msg_user', '_msg_stage', '_msg_due', '_msg_created', '_msg_sent'):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, (column[i] for i in keep)))
+
+    # --- Рассылки ---
+
+    async def create_campaign(self, text: str, image_url: Optional[str] = None,
+                              button_url: Optional[str] = None,
+                              button_text: Optional[str] = None) -> int:
+        campaign_id = len(self._campaigns) + 1
+        self._campaigns.append([campaign_id, text, image_url, button_url, button_text, 0])
+        return campaign_id
+
+    async def finish_campaign(self, campaign_id: int, sent_count: int):
+        if 0 < campaign_id <= len(self._campaigns):
+            self._campaigns[campaign_id - 1][5] = sent_count
+
+    async def update_campaign(self, campaign_id: int, text: str,
+                              button_url: Optional[str], button_text: Optional[str]):
+        if 0 < campaign_id <= len(self._campaigns):
+            self._campaigns[campaign_id - 1][1] = text
+            self._campaigns[campaign_id - 1][3:5] = [button_url, button_text]
+
+    async def get_campaign(self, campaign_id: int) -> Optional[Tuple]:
+        if 0 < campaign_id <= len(self._campaigns):
+            return tuple(self._campaigns[campaign_id - 1])
+        return None
+
+    async def add_campaign_messages(self, campaign_id: int, messages: List[Tuple[int, int]]):
+        record = self._campaign_messages.setdefault(campaign_id, [array('q'), array('q'), True])
+        for chat_id, message_id in messages:
+            if record[2] and record[0] and chat_id <= record[0][-1]:
+                record[2] = False
+            record[0].append(chat_id)
+            record[1].append(message_id)
+
+    async def get_campaign_messages(self, campaign_id: int, after_chat_id: int, limit: int) -> List[Tuple[int, int]]:
+        record = self._campaign_messages.get(campaign_id)
+        if record is None:
+            return []
+        if not record[2]:
+            # Пачки пришли не по порядку - сортируем один раз перед чтением
+            pairs = dict(zip(record[0], record[1]))
+            chat_ids = sorted(pairs)
+            record[:] = [array('q', chat_ids), array('q', (pairs[chat_id] for chat_id in chat_ids)), True]
+        chat_ids, message_ids = record[0], record[1]
+        start = bisect_right(chat_ids, after_chat_id)
+        return list(zip(chat_ids[start:start + limit], message_ids[start:start + limit]))
+
+    async def delete_campaign_messages(self, campaign_id: int, chat_ids: List[int]):
+        record = self._campaign_messages.get(campaign_id)
+        if record is None:
+            return
+        removed = set(chat_ids)
+        keep = [i for i, chat_id in enumerate(record[0]) if chat_id not in removed]
+        record[0] = array('q', (record[0][i] for i in keep))
+        record[1] = array('q', (record[1][i] for i in keep))
+
+    # --- Сегменты ---
+
+    async def create_segment_snapshot(self, query: str) -> int:
+        # Движок для тестов: предикат проверяется полным проходом по колонкам
+        predicate = compile_predicate(parse_segment(query))
+        no_attributes = {}
+        members = array('q', sorted(
+            user_id for i, user_id in enumerate(self._sub_ids)
+            if predicate(user_id, self._sub_stage[i], self._sub_time[i], self._sub_username[i],
+                         self._attributes.get(user_id, no_attributes))
+        ))
+        self._snapshots.append([len(self._snapshots) + 1, query, members, 0])
+        return len(self._snapshots)
+
+    async def get_segment_snapshot(self, snapshot_id: int) -> Optional[Tuple]:
+        if 0 < snapshot_id <= len(self._snapshots):
+            snapshot_id, query, members, cursor = self._snapshots[snapshot_id - 1]
+            return snapshot_id, query, len(members), cursor
+        return None
+
+    async def get_segment_batch(self, snapshot_id: int, after_user_id: int, limit: int) -> List[int]:
+        if not 0 < snapshot_id <= len(self._snapshots):
+            return []
+        members = self._snapshots[snapshot_id - 1][2]
+        start = bisect_right(members, after_user_id)
+        return members[start:start + limit].tolist()
+
+    async def update_segment_cursor(self, snapshot_id: int, cursor: int):
+        if 0 < snapshot_id <= len(self._snapshots):
+            self._snapshots[snapshot_id - 1][3] = cursor
@@ -0,0 +1,244 @@
+import calendar
+import operator
+import re
+import time
+from typing import Any, Callable, List, Tuple
+
+
+class SegmentQueryError(ValueError):
+    """Ошибка разбора запроса сегмента"""
+
+
+_TOKEN_RE = re.compile(r'''\s*(?:(?P<op><=|>=|!=|=|<|>)|(?P<paren>[()])|"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<word>[^\s()=!<>"']+))''')
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?$')
+_RELATIVE_RE = re.compile(r'^-(\d+)([dhm])$')
+_RELATIVE_UNITS = {'d': ('days', 86400), 'h': ('hours', 3600), 'm': ('minutes', 60)}
+
+_COLUMNS = {'stage': 's.welcome_stage', 'user_id': 's.user_id', 'username': 's.username'}
+_OPS = {'=': operator.eq, '!=': operator.ne, '<': operator.lt,
+        '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+def _tokenize(query: str) -> List[Tuple[str, Any]]:
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = _TOKEN_RE.match(query, pos)
+        if not match or match.end() == pos:
+            raise SegmentQueryError(f"Не удалось разобрать запрос с позиции {pos}: {query[pos:]!r}")
+        pos = match.end()
+        if match.group('op'):
+            tokens.append(('op', match.group('op')))
+        elif match.group('paren'):
+            tokens.append(('paren', match.group('paren')))
+        elif match.group('dq') is not None or match.group('sq') is not None:
+            tokens.append(('str', match.group('dq') if match.group('dq') is not None else match.group('sq')))
+        else:
+            word = match.group('word')
+            if word.lower() in ('and', 'or', 'not'):
+                tokens.append(('kw', word.lower()))
+            else:
+                tokens.append(('word', word))
+    return tokens
+
+
+def normalize_attribute_value(value):
+    """Единый тип значения атрибута: числа и числовые строки - числом, остальное - строкой.
+
+    Применяется и при записи атрибута, и к значению в запросе, поэтому
+    age='10' и age=10 хранятся и сравниваются одинаково во всех движках.
+    """
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    value = str(value)
+    if re.fullmatch(r'-?\d+', value):
+        return int(value)
+    if re.fullmatch(r'-?\d+\.\d+', value):
+        return float(value)
+    return value
+
+
+def _literal(kind: str, text: str):
+    """Значение литерала: число, дата, относительное время или строка"""
+    if kind == 'str':
+        return text
+    if re.fullmatch(r'-?\d+', text):
+        return int(text)
+    if re.fullmatch(r'-?\d+\.\d+', text):
+        return float(text)
+    return text
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.expr()
+        if self.pos != len(self.tokens):
+            raise SegmentQueryError(f"Лишний фрагмент запроса: {self.peek()[1]!r}")
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek() == ('kw', 'or'):
+            self.take()
+            node = ('or', node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() == ('kw', 'and'):
+            self.take()
+            node = ('and', node, self.factor())
+        return node
+
+    def factor(self):
+        kind, value = self.peek()
+        if (kind, value) == ('kw', 'not'):
+            self.take()
+            return ('not', self.factor())
+        if (kind, value) == ('paren', '('):
+            self.take()
+            node = self.expr()
+            if self.take() != ('paren', ')'):
+                raise SegmentQueryError("Ожидалась закрывающая скобка")
+            return node
+        return self.predicate()
+
+    def predicate(self):
+        kind, field = self.take()
+        if kind != 'word':
+            raise SegmentQueryError(f"Ожидалось имя поля, получено: {field!r}")
+        kind, op = self.take()
+        if kind != 'op':
+            raise SegmentQueryError(f"Ожидался оператор после {field!r}")
+        kind, raw = self.take()
+        if kind not in ('word', 'str'):
+            raise SegmentQueryError(f"Ожидалось значение для {field!r}")
+
+        field = field.lower() if not field.startswith('attr.') else field
+        if field == 'tag':
+            if op not in ('=', '!='):
+                raise SegmentQueryError("Для tag допустимы только = и !=")
+            node = ('attr', 'tag', '=', raw)
+            return ('not', node) if op == '!=' else node
+        if field.startswith('attr.') and len(field) > 5:
+            return ('attr', field[5:], op, normalize_attribute_value(raw))
+        if field == 'subscribed':
+            if _RELATIVE_RE.match(raw):
+                return ('subscribed', op, raw)
+            if _DATE_RE.match(raw):
+                return ('subscribed', op, raw.replace('T', ' '))
+            raise SegmentQueryError(f"Некорректная дата: {raw!r}")
+        if field == 'username':
+            # username - текстовая колонка: 123 сравниваем как строку "123" во всех движках
+            return ('column', field, op, raw)
+        if field in _COLUMNS:
+            value = _literal(kind, raw)
+            if not isinstance(value, int):
+                raise SegmentQueryError(f"Поле {field} ожидает целое число, получено: {raw!r}")
+            return ('column', field, op, value)
+        raise SegmentQueryError(f"Неизвестное поле: {field!r}")
+
+
+def parse_segment(query: str):
+    """Разбор запроса сегмента в дерево.
+
+    Примеры запросов:
+        stage >= 2 and subscribed >= 2026-10-01
+        tag = ML
+        (tag = ML or tag = AI) and not attr.city = "Санкт-Петербург"
+        subscribed >= -30d
+
+    Поля: stage, subscribed (дата YYYY-MM-DD или смещение от текущего
+    момента: -30d, -12h, -15m), user_id, username, tag (только = и !=)
+    и произвольные атрибуты attr.<имя>. Значения с пробелами берутся в
+    кавычки: subscribed < "2026-02-10 12:30". Атрибуты сравниваются с учётом
+    типа: attr.age > 5 находит только числовые значения age.
+    """
+    tokens = _tokenize(query)
+    if not tokens:
+        raise SegmentQueryError("Пустой запрос сегмента")
+    return _Parser(tokens).parse()
+
+
+def compile_sql(node) -> Tuple[str, list]:
+    """Условие WHERE по таблице subscribers (алиас s) и его параметры"""
+    kind = node[0]
+    if kind in ('and', 'or'):
+        left_sql, left_params = compile_sql(node[1])
+        right_sql, right_params = compile_sql(node[2])
+        return f"({left_sql} {kind.upper()} {right_sql})", left_params + right_params
+    if kind == 'not':
+        sql, params = compile_sql(node[1])
+        return f"(NOT {sql})", params
+    if kind == 'attr':
+        _, key, op, value = node
+        # Сравниваем только значения того же типа: число с числом, строку со строкой
+        types = "'text'" if isinstance(value, str) else "'integer', 'real'"
+        return (f"s.user_id IN (SELECT user_id FROM subscriber_attributes "
+                f"WHERE key = ? AND value {op} ? AND typeof(value) IN ({types}))",
+                [key, value])
+    if kind == 'subscribed':
+        _, op, value = node
+        relative = _RELATIVE_RE.match(value)
+        if relative:
+            amount, unit = relative.groups()
+            return f"s.subscribed_at {op} datetime('now', ?)", [f"-{amount} {_RELATIVE_UNITS[unit][0]}"]
+        return f"s.subscribed_at {op} datetime(?)", [value]
+    _, field, op, value = node
+    return f"{_COLUMNS[field]} {op} ?", [value]
+
+
+def _timestamp(value: str) -> float:
+    relative = _RELATIVE_RE.match(value)
+    if relative:
+        amount, unit = relative.groups()
+        return time.time() - int(amount) * _RELATIVE_UNITS[unit][1]
+    value = value if len(value) > 10 else f"{value} 00:00"
+    fmt = '%Y-%m-%d %H:%M:%S' if value.count(':') == 2 else '%Y-%m-%d %H:%M'
+    return calendar.timegm(time.strptime(value, fmt))
+
+
+def compile_predicate(node) -> Callable[[int, int, float, str, dict], bool]:
+    """Python-предикат f(user_id, stage, subscribed_ts, username, attrs) для движка в памяти"""
+    kind = node[0]
+    if kind in ('and', 'or'):
+        left, right = compile_predicate(node[1]), compile_predicate(node[2])
+        if kind == 'and':
+            return lambda *row: left(*row) and right(*row)
+        return lambda *row: left(*row) or right(*row)
+    if kind == 'not':
+        inner = compile_predicate(node[1])
+        return lambda *row: not inner(*row)
+    if kind == 'attr':
+        _, key, op, value = node
+        compare = _OPS[op]
+        is_text = isinstance(value, str)
+
+        def match_attr(user_id, stage, ts, username, attrs):
+            return any(isinstance(stored, str) == is_text and compare(stored, value)
+                       for stored in attrs.get(key, ()))
+        return match_attr
+    if kind == 'subscribed':
+        _, op, value = node
+        compare = _OPS[op]
+        border = int(_timestamp(value))
+        return lambda user_id, stage, ts, username, attrs: compare(int(ts), border)
+    _, field, op, value = node
+    compare = _OPS[op]
+    index = {'user_id': 0, 'stage': 1, 'username': 3}[field]
+    return lambda *row: row[index] is not None and compare(row[index], value)
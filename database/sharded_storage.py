@@ -0,0 +1,160 @@
+import asyncio
+import heapq
+import os
+from typing import List, Optional, Tuple
+
+from database.segments import compile_sql, parse_segment
+from database.sqlite_storage import SqliteStorage
+from database.storage import Storage
+
+
+class ShardedSqliteStorage(Storage):
+    """Хранилище из N файлов SQLite, подписчики распределены по user_id.
+
+    Запись в SQLite блокирует весь файл, поэтому разнос пользователей по
+    шардам позволяет писать в разные файлы параллельно. Запланированные
+    сообщения лежат в шарде своего пользователя, а их глобальный ID
+    кодирует номер шарда: global_id = local_id * N + shard.
+    Рассылки не привязаны к пользователю и хранятся в шарде 0, а их
+    отправленные сообщения - в шарде получателя. Снимок
+    сегмента заводится во всех шардах с одним ID, участники лежат в шарде
+    своего пользователя, а размер и курсор обхода - в шарде 0.
+    """
+
+    def __init__(self, path: str = 'subscribers.db', shards: int = 4):
+        if shards < 1:
+            raise ValueError("Количество шардов должно быть не меньше 1")
+        base, ext = os.path.splitext(path)
+        self.shards = [SqliteStorage(f"{base}.{i}{ext or '.db'}") for i in range(shards)]
+
+    def _shard(self, user_id: int) -> SqliteStorage:
+        return self.shards[user_id % len(self.shards)]
+
+    def _split_id(self, message_id: int) -> Tuple[SqliteStorage, int]:
+        local_id, shard_no = divmod(message_id, len(self.shards))
+        return self.shards[shard_no], local_id
+
+    async def _each(self, method: str, *args) -> list:
+        return await asyncio.gather(*(getattr(shard, method)(*args) for shard in self.shards))
+
+    async def connect(self):
+        await self._each('connect')
+
+    # --- Подписчики ---
+
+    async def add_subscriber(self, user_id: int, username: str, first_name: str):
+        await self._shard(user_id).add_subscriber(user_id, username, first_name)
+
+    async def get_all_subscribers(self) -> List[int]:
+        return [user_id for part in await self._each('get_all_subscribers') for user_id in part]
+
+    async def get_subscribers_batch(self, after_user_id: int, limit: int) -> List[int]:
+        parts = await self._each('get_subscribers_batch', after_user_id, limit)
+        return list(heapq.merge(*parts))[:limit]
+
+    async def get_subscribers_for_welcome(self, max_stage: int) -> List[Tuple]:
+        return [row for part in await self._each('get_subscribers_for_welcome', max_stage) for row in part]
+
+    async def get_subscriber_profiles(self, user_ids: List[int]) -> List[Tuple]:
+        by_shard = [[] for _ in self.shards]
+        for user_id in user_ids:
+            by_shard[user_id % len(self.shards)].append(user_id)
+        parts = await asyncio.gather(*(
+            shard.get_subscriber_profiles(ids) for shard, ids in zip(self.shards, by_shard) if ids
+        ))
+        return [row for part in parts for row in part]
+
+    async def update_welcome_stage(self, user_id: int, new_stage: int):
+        await self._shard(user_id).update_welcome_stage(user_id, new_stage)
+
+    # --- Теги и атрибуты подписчиков ---
+
+    async def add_tag(self, user_id: int, tag: str):
+        await self._shard(user_id).add_tag(user_id, tag)
+
+    async def remove_tag(self, user_id: int, tag: str):
+        await self._shard(user_id).remove_tag(user_id, tag)
+
+    async def set_attribute(self, user_id: int, key: str, value):
+        await self._shard(user_id).set_attribute(user_id, key, value)
+
+    # --- Запланированные сообщения ---
+
+    async def add_scheduled_message(self, user_id: int, message_stage: int, delay_minutes: int):
+        await self._shard(user_id).add_scheduled_message(user_id, message_stage, delay_minutes)
+
+    async def get_pending_messages(self) -> List[Tuple]:
+        n = len(self.shards)
+        parts = await self._each('_pending_rows')
+        # Каждый шард уже отсортирован по scheduled_for - сливаем без полной сортировки
+        merged = heapq.merge(
+            *([(due, local_id * n + shard_no, user_id, stage, username)
+               for due, local_id, user_id, stage, username in rows]
+              for shard_no, rows in enumerate(parts)),
+            key=lambda row: row[0]
+        )
+        return [row[1:] for row in merged]
+
+    async def mark_message_sent(self, message_id: int):
+        shard, local_id = self._split_id(message_id)
+        await shard.mark_message_sent(local_id)
+
+    async def cleanup_old_messages(self):
+        await self._each('cleanup_old_messages')
+
+    # --- Рассылки ---
+
+    async def create_campaign(self, text: str, image_url: Optional[str] = None,
+                              button_url: Optional[str] = None,
+                              button_text: Optional[str] = None) -> int:
+        return await self.shards[0].create_campaign(text, image_url, button_url, button_text)
+
+    async def finish_campaign(self, campaign_id: int, sent_count: int):
+        await self.shards[0].finish_campaign(campaign_id, sent_count)
+
+    async def update_campaign(self, campaign_id: int, text: str,
+                              button_url: Optional[str], button_text: Optional[str]):
+        await self.shards[0].update_campaign(campaign_id, text, button_url, button_text)
+
+    async def get_campaign(self, campaign_id: int) -> Optional[Tuple]:
+        return await self.shards[0].get_campaign(campaign_id)
+
+    async def add_campaign_messages(self, campaign_id: int, messages: List[Tuple[int, int]]):
+        by_shard = [[] for _ in self.shards]
+        for chat_id, message_id in messages:
+            by_shard[chat_id % len(self.shards)].append((chat_id, message_id))
+        await asyncio.gather(*(
+            shard.add_campaign_messages(campaign_id, part) for shard, part in zip(self.shards, by_shard) if part
+        ))
+
+    async def get_campaign_messages(self, campaign_id: int, after_chat_id: int, limit: int) -> List[Tuple[int, int]]:
+        parts = await self._each('get_campaign_messages', campaign_id, after_chat_id, limit)
+        return list(heapq.merge(*parts))[:limit]
+
+    async def delete_campaign_messages(self, campaign_id: int, chat_ids: List[int]):
+        by_shard = [[] for _ in self.shards]
+        for chat_id in chat_ids:
+            by_shard[chat_id % len(self.shards)].append(chat_id)
+        await asyncio.gather(*(
+            shard.delete_campaign_messages(campaign_id, part) for shard, part in zip(self.shards, by_shard) if part
+        ))
+
+    # --- Сегменты ---
+
+    async def create_segment_snapshot(self, query: str) -> int:
+        where, params = compile_sql(parse_segment(query))
+        snapshot_id = await self.shards[0]._create_snapshot_row(query)
+        await asyncio.gather(*(shard._create_snapshot_row(query, snapshot_id) for shard in self.shards[1:]))
+        sizes = await self._each('_materialise_segment', snapshot_id, where, params)
+        await self.shards[0]._set_snapshot_size(snapshot_id, sum(sizes))
+        return snapshot_id
+
+    async def get_segment_snapshot(self, snapshot_id: int) -> Optional[Tuple]:
+        return await self.shards[0].get_segment_snapshot(snapshot_id)
+
+    async def get_segment_batch(self, snapshot_id: int, after_user_id: int, limit: int) -> List[int]:
+        parts = await self._each('get_segment_batch', snapshot_id, after_user_id, limit)
+        return list(heapq.merge(*parts))[:limit]
+
+    async def update_segment_cursor(self, snapshot_id: int, cursor: int):
+        await self.shards[0].update_segment_cursor(snapshot_id, cursor)
@@ -0,0 +1,369 @@
+import aiosqlite
+import logging
+from typing import List, Optional, Tuple
+
+from database.segments import compile_sql, normalize_attribute_value, parse_segment
+from database.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CHUNK = 500
+
+
+class SqliteStorage(Storage):
+    """Хранилище в одном файле SQLite"""
+
+    def __init__(self, path: str = 'subscribers.db'):
+        self.path = path
+
+    async def connect(self):
+        """Создание таблиц базы данных с поддержкой миграций"""
+        async with aiosqlite.connect(self.path) as db:
+            # Включаем поддержку внешних ключей
+            await db.execute("PRAGMA foreign_keys = ON")
+
+            # Создаем таблицу подписчиков
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    welcome_stage INTEGER DEFAULT 0
+                )
+            ''')
+
+            # Создаем таблицу для отслеживания отправленных сообщений
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS scheduled_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    message_stage INTEGER,
+                    scheduled_for TIMESTAMP,
+                    sent BOOLEAN DEFAULT FALSE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES subscribers (user_id) ON DELETE CASCADE
+                )
+            ''')
+
+            # Создаем таблицу рассылок
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS campaigns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT,
+                    image_url TEXT,
+                    button_url TEXT,
+                    button_text TEXT,
+                    sent_count INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+
+            # Отправленные сообщения рассылок (для правки и отзыва)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS campaign_messages (
+                    campaign_id INTEGER,
+                    chat_id INTEGER,
+                    message_id INTEGER,
+                    PRIMARY KEY (campaign_id, chat_id)
+                ) WITHOUT ROWID
+            ''')
+
+            # Теги и атрибуты подписчиков (value без типа - числа хранятся как числа)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS subscriber_attributes (
+                    user_id INTEGER,
+                    key TEXT,
+                    value,
+                    PRIMARY KEY (user_id, key, value)
+                ) WITHOUT ROWID
+            ''')
+
+            # Снимки сегментов и их участники
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS segment_snapshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    query TEXT,
+                    size INTEGER DEFAULT 0,
+                    cursor INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS segment_members (
+                    snapshot_id INTEGER,
+                    user_id INTEGER,
+                    PRIMARY KEY (snapshot_id, user_id)
+                ) WITHOUT ROWID
+            ''')
+
+            # ✅ МИГРАЦИЯ: Добавляем столбец welcome_stage если его нет
+            try:
+                await db.execute("ALTER TABLE subscribers ADD COLUMN welcome_stage INTEGER DEFAULT 0")
+                logger.info("Миграция: добавлен столбец welcome_stage")
+            except aiosqlite.OperationalError:
+                # Столбец уже существует - это нормально
+                pass
+
+            # Индексы для запросов сегментов
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_attributes_key_value ON subscriber_attributes (key, value, user_id)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_subscribers_stage ON subscribers (welcome_stage)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_subscribers_subscribed ON subscribers (subscribed_at)")
+
+            await db.commit()
+
+    async def add_subscriber(self, user_id: int, username: str, first_name: str):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                """INSERT OR REPLACE INTO subscribers
+                   (user_id, username, first_name, subscribed_at, welcome_stage)
+                   VALUES (?, ?, ?, datetime('now'), 0)""",
+                (user_id, username, first_name)
+            )
+            await db.commit()
+
+    async def get_all_subscribers(self) -> List[int]:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute("SELECT user_id FROM subscribers")
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+
+    async def get_subscribers_batch(self, after_user_id: int, limit: int) -> List[int]:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(
+                "SELECT user_id FROM subscribers WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (after_user_id, limit)
+            )
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+
+    async def get_subscribers_for_welcome(self, max_stage: int) -> List[Tuple]:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute('''
+                SELECT s.user_id, s.welcome_stage, s.subscribed_at
+                FROM subscribers s
+                WHERE s.welcome_stage < ?
+            ''', (max_stage,))
+            rows = await cursor.fetchall()
+            return rows
+
+    async def get_subscriber_profiles(self, user_ids: List[int]) -> List[Tuple]:
+        rows = []
+        async with aiosqlite.connect(self.path) as db:
+            # Пачками, чтобы не упереться в лимит параметров SQLite
+            for start in range(0, len(user_ids), PROFILE_CHUNK):
+                chunk = user_ids[start:start + PROFILE_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = await db.execute(
+                    f"""SELECT s.user_id, s.username, s.first_name, s.welcome_stage, a.value
+                        FROM subscribers s
+                        LEFT JOIN subscriber_attributes a ON a.user_id = s.user_id AND a.key = 'promo_code'
+                        WHERE s.user_id IN ({placeholders})""",
+                    chunk
+                )
+                rows.extend(await cursor.fetchall())
+        return rows
+
+    async def update_welcome_stage(self, user_id: int, new_stage: int):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                "UPDATE subscribers SET welcome_stage = ? WHERE user_id = ?",
+                (new_stage, user_id)
+            )
+            await db.commit()
+
+    async def add_tag(self, user_id: int, tag: str):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                "INSERT OR IGNORE INTO subscriber_attributes (user_id, key, value) VALUES (?, 'tag', ?)",
+                (user_id, str(tag))
+            )
+            await db.commit()
+
+    async def remove_tag(self, user_id: int, tag: str):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                "DELETE FROM subscriber_attributes WHERE user_id = ? AND key = 'tag' AND value = ?",
+                (user_id, str(tag))
+            )
+            await db.commit()
+
+    async def set_attribute(self, user_id: int, key: str, value):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                "DELETE FROM subscriber_attributes WHERE user_id = ? AND key = ?",
+                (user_id, key)
+            )
+            if value is not None:
+                await db.execute(
+                    "INSERT INTO subscriber_attributes (user_id, key, value) VALUES (?, ?, ?)",
+                    (user_id, key, normalize_attribute_value(value))
+                )
+            await db.commit()
+
+    async def add_scheduled_message(self, user_id: int, message_stage: int, delay_minutes: int):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                """INSERT INTO scheduled_messages
+                   (user_id, message_stage, scheduled_for)
+                   VALUES (?, ?, datetime('now', ?))""",
+                (user_id, message_stage, f"+{int(delay_minutes)} minutes")
+            )
+            await db.commit()
+
+    async def _pending_rows(self) -> List[Tuple]:
+        """Строки (scheduled_for, id, user_id, message_stage, username), готовые к отправке"""
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute('''
+                SELECT sm.scheduled_for, sm.id, sm.user_id, sm.message_stage, s.username
+                FROM scheduled_messages sm
+                JOIN subscribers s ON sm.user_id = s.user_id
+                WHERE sm.sent = FALSE AND sm.scheduled_for <= datetime('now')
+                ORDER BY sm.scheduled_for ASC
+            ''')
+            return await cursor.fetchall()
+
+    async def get_pending_messages(self) -> List[Tuple]:
+        return [row[1:] for row in await self._pending_rows()]
+
+    async def mark_message_sent(self, message_id: int):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                "UPDATE scheduled_messages SET sent = TRUE WHERE id = ?",
+                (message_id,)
+            )
+            await db.commit()
+
+    async def cleanup_old_messages(self):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                "DELETE FROM scheduled_messages WHERE sent = TRUE AND created_at < datetime('now', '-7 days')"
+            )
+            await db.execute('''
+                DELETE FROM segment_members WHERE snapshot_id IN (
+                    SELECT id FROM segment_snapshots WHERE created_at < datetime('now', '-7 days')
+                )
+            ''')
+            await db.execute("DELETE FROM segment_snapshots WHERE created_at < datetime('now', '-7 days')")
+            await db.commit()
+
+    async def create_campaign(self, text: str, image_url: Optional[str] = None,
+                              button_url: Optional[str] = None,
+                              button_text: Optional[str] = None) -> int:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(
+                """INSERT INTO campaigns (text, image_url, button_url, button_text)
+                   VALUES (?, ?, ?, ?)""",
+                (text, image_url, button_url, button_text)
+            )
+            await db.commit()
+            return cursor.lastrowid
+
+    async def finish_campaign(self, campaign_id: int, sent_count: int):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                "UPDATE campaigns SET sent_count = ?, finished_at = datetime('now') WHERE id = ?",
+                (sent_count, campaign_id)
+            )
+            await db.commit()
+
+    async def update_campaign(self, campaign_id: int, text: str,
+                              button_url: Optional[str], button_text: Optional[str]):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute(
+                "UPDATE campaigns SET text = ?, button_url = ?, button_text = ? WHERE id = ?",
+                (text, button_url, button_text, campaign_id)
+            )
+            await db.commit()
+
+    async def get_campaign(self, campaign_id: int) -> Optional[Tuple]:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(
+                """SELECT id, text, image_url, button_url, button_text, sent_count
+                   FROM campaigns WHERE id = ?""",
+                (campaign_id,)
+            )
+            return await cursor.fetchone()
+
+    async def add_campaign_messages(self, campaign_id: int, messages: List[Tuple[int, int]]):
+        async with aiosqlite.connect(self.path) as db:
+            await db.executemany(
+                "INSERT OR REPLACE INTO campaign_messages (campaign_id, chat_id, message_id) VALUES (?, ?, ?)",
+                [(campaign_id, chat_id, message_id) for chat_id, message_id in messages]
+            )
+            await db.commit()
+
+    async def get_campaign_messages(self, campaign_id: int, after_chat_id: int, limit: int) -> List[Tuple[int, int]]:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(
+                """SELECT chat_id, message_id FROM campaign_messages
+                   WHERE campaign_id = ? AND chat_id > ?
+                   ORDER BY chat_id LIMIT ?""",
+                (campaign_id, after_chat_id, limit)
+            )
+            return await cursor.fetchall()
+
+    async def delete_campaign_messages(self, campaign_id: int, chat_ids: List[int]):
+        async with aiosqlite.connect(self.path) as db:
+            await db.executemany(
+                "DELETE FROM campaign_messages WHERE campaign_id = ? AND chat_id = ?",
+                [(campaign_id, chat_id) for chat_id in chat_ids]
+            )
+            await db.commit()
+
+    async def _create_snapshot_row(self, query: str, snapshot_id: Optional[int] = None) -> int:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(
+                "INSERT INTO segment_snapshots (id, query) VALUES (?, ?)",
+                (snapshot_id, query)
+            )
+            await db.commit()
+            return cursor.lastrowid
+
+    async def _materialise_segment(self, snapshot_id: int, where: str, params: list) -> int:
+        """Запись участников сегмента в снимок одним INSERT ... SELECT по индексам"""
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(
+                f"""INSERT OR IGNORE INTO segment_members (snapshot_id, user_id)
+                    SELECT ?, s.user_id FROM subscribers s WHERE {where}""",
+                [snapshot_id] + params
+            )
+            await db.commit()
+            return cursor.rowcount
+
+    async def _set_snapshot_size(self, snapshot_id: int, size: int):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute("UPDATE segment_snapshots SET size = ? WHERE id = ?", (size, snapshot_id))
+            await db.commit()
+
+    async def create_segment_snapshot(self, query: str) -> int:
+        where, params = compile_sql(parse_segment(query))
+        snapshot_id = await self._create_snapshot_row(query)
+        size = await self._materialise_segment(snapshot_id, where, params)
+        await self._set_snapshot_size(snapshot_id, size)
+        return snapshot_id
+
+    async def get_segment_snapshot(self, snapshot_id: int) -> Optional[Tuple]:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(
+                "SELECT id, query, size, cursor FROM segment_snapshots WHERE id = ?",
+                (snapshot_id,)
+            )
+            return await cursor.fetchone()
+
+    async def get_segment_batch(self, snapshot_id: int, after_user_id: int, limit: int) -> List[int]:
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(
+                """SELECT user_id FROM segment_members
+                   WHERE snapshot_id = ? AND user_id > ?
+                   ORDER BY user_id LIMIT ?""",
+                (snapshot_id, after_user_id, limit)
+            )
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
+
+    async def update_segment_cursor(self, snapshot_id: int, cursor: int):
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute("UPDATE segment_snapshots SET cursor = ? WHERE id = ?", (cursor, snapshot_id))
+            await db.commit()
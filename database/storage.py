@@ -0,0 +1,135 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+
+class Storage(ABC):
+    """Интерфейс хранилища: подписчики, запланированные сообщения и рассылки"""
+
+    async def connect(self):
+        """Подготовка движка к работе (создание таблиц, файлов и т.п.)"""
+
+    async def close(self):
+        """Освобождение ресурсов движка"""
+
+    # --- Подписчики ---
+
+    @abstractmethod
+    async def add_subscriber(self, user_id: int, username: str, first_name: str):
+        """Добавление (или перезапись) подписчика"""
+
+    @abstractmethod
+    async def get_all_subscribers(self) -> List[int]:
+        """ID всех подписчиков"""
+
+    @abstractmethod
+    async def get_subscribers_batch(self, after_user_id: int, limit: int) -> List[int]:
+        """Следующие limit подписчиков с user_id > after_user_id по возрастанию"""
+
+    @abstractmethod
+    async def get_subscribers_for_welcome(self, max_stage: int) -> List[Tuple]:
+        """Строки (user_id, welcome_stage, subscribed_at) со стадией меньше max_stage"""
+
+    @abstractmethod
+    async def get_subscriber_profiles(self, user_ids: List[int]) -> List[Tuple]:
+        """Строки (user_id, username, first_name, welcome_stage, promo_code) для персонализации"""
+
+    @abstractmethod
+    async def update_welcome_stage(self, user_id: int, new_stage: int):
+        """Обновление стадии приветственных сообщений"""
+
+    # --- Теги и атрибуты подписчиков ---
+
+    @abstractmethod
+    async def add_tag(self, user_id: int, tag: str):
+        """Добавление тега подписчику"""
+
+    @abstractmethod
+    async def remove_tag(self, user_id: int, tag: str):
+        """Удаление тега у подписчика"""
+
+    @abstractmethod
+    async def set_attribute(self, user_id: int, key: str, value):
+        """Установка атрибута подписчика (None - удаление); значение приводится normalize_attribute_value"""
+
+    # --- Запланированные сообщения ---
+
+    @abstractmethod
+    async def add_scheduled_message(self, user_id: int, message_stage: int, delay_minutes: int):
+        """Планирование сообщения через delay_minutes минут"""
+
+    @abstractmethod
+    async def get_pending_messages(self) -> List[Tuple]:
+        """Строки (id, user_id, message_stage, username), готовые к отправке"""
+
+    @abstractmethod
+    async def mark_message_sent(self, message_id: int):
+        """Отметка сообщения как отправленного"""
+
+    @abstractmethod
+    async def cleanup_old_messages(self):
+        """Удаление отправленных сообщений старше 7 дней"""
+
+    # --- Рассылки ---
+
+    @abstractmethod
+    async def create_campaign(self, text: str, image_url: Optional[str] = None,
+                              button_url: Optional[str] = None,
+                              button_text: Optional[str] = None) -> int:
+        """Создание записи о рассылке, возвращает её ID"""
+
+    @abstractmethod
+    async def finish_campaign(self, campaign_id: int, sent_count: int):
+        """Фиксация числа отправленных сообщений рассылки (после каждой пачки и в конце)"""
+
+    @abstractmethod
+    async def update_campaign(self, campaign_id: int, text: str,
+                              button_url: Optional[str], button_text: Optional[str]):
+        """Сохранение нового текста и кнопки рассылки после исправления"""
+
+    @abstractmethod
+    async def get_campaign(self, campaign_id: int) -> Optional[Tuple]:
+        """Строка (id, text, image_url, button_url, button_text, sent_count) или None"""
+
+    @abstractmethod
+    async def add_campaign_messages(self, campaign_id: int, messages: List[Tuple[int, int]]):
+        """Пакетная запись отправленных сообщений рассылки: (chat_id, message_id)"""
+
+    @abstractmethod
+    async def get_campaign_messages(self, campaign_id: int, after_chat_id: int, limit: int) -> List[Tuple[int, int]]:
+        """Следующие limit пар (chat_id, message_id) рассылки с chat_id > after_chat_id по возрастанию"""
+
+    @abstractmethod
+    async def delete_campaign_messages(self, campaign_id: int, chat_ids: List[int]):
+        """Удаление записей об отозванных сообщениях рассылки"""
+
+    # --- Сегменты ---
+
+    @abstractmethod
+    async def create_segment_snapshot(self, query: str) -> int:
+        """Материализация сегмента по запросу, возвращает ID снимка"""
+
+    @abstractmethod
+    async def get_segment_snapshot(self, snapshot_id: int) -> Optional[Tuple]:
+        """Строка (id, query, size, cursor) или None"""
+
+    @abstractmethod
+    async def get_segment_batch(self, snapshot_id: int, after_user_id: int, limit: int) -> List[int]:
+        """Следующие limit получателей снимка с user_id > after_user_id по возрастанию"""
+
+    @abstractmethod
+    async def update_segment_cursor(self, snapshot_id: int, cursor: int):
+        """Сохранение позиции обхода снимка (последний обработанный user_id)"""
+
+
+def create_storage(engine: str, path: str = 'subscribers.db', shards: int = 1) -> Storage:
+    """Создание движка хранилища по имени: sqlite, memory или sharded"""
+    if engine == 'sqlite':
+        from database.sqlite_storage import SqliteStorage
+        return SqliteStorage(path)
+    if engine == 'memory':
+        from database.memory_storage import MemoryStorage
+        return MemoryStorage()
+    if engine == 'sharded':
+        from database.sharded_storage import ShardedSqliteStorage
+        return ShardedSqliteStorage(path, shards)
+    raise ValueError(f"Неизвестный движок хранилища: {engine}")
@@ -3,6 +3,7 @@ from aiogram.filters import CommandStart, Command
 from aiogram.enums import ParseMode
 import logging
 from database.db import add_subscriber, add_scheduled_message, WELCOME_MESSAGES
+from services.welcome import WELCOME_TEMPLATES
 
 user_router = Router()
 logger = logging.getLogger(__name__)
@@ -20,8 +21,8 @@ async def cmd_start(message: types.Message):
         logger.info(f"✅ Пользователь {user.id} добавлен в БД")
 
         # Отправляем первое приветственное сообщение сразу
-        first_message = WELCOME_MESSAGES[0]
-        await message.answer(first_message["text"])
+        first_message = WELCOME_TEMPLATES[0].render({"first_name": user.first_name, "username": user.username})
+        await message.answer(first_message, parse_mode=ParseMode.HTML)
         logger.info(f"📨 Отправлено приветствие пользователю {user.id}")
 
         # Планируем остальные сообщения
@@ -5,16 +5,50 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from config import BOT_TOKEN
-from services.mailing import broadcast_message
+from database.db import create_table, add_tag, remove_tag, set_attribute
+from services.mailing import broadcast_message, edit_campaign, delete_campaign
 from aiogram import Bot
 
 
+async def manage_audience(command: str, args: list):
+    """Теги и атрибуты для сегментов: tag/untag <тег> <user_id>..., attr <ключ> <значение> <user_id>..."""
+    if command == "attr":
+        key, value, user_ids = args[0], args[1], args[2:]
+        for user_id in user_ids:
+            await set_attribute(int(user_id), key, value)
+        print(f"Атрибут {key}={value} установлен {len(user_ids)} пользователям")
+        return
+
+    tag, user_ids = args[0], args[1:]
+    for user_id in user_ids:
+        if command == "tag":
+            await add_tag(int(user_id), tag)
+        else:
+            await remove_tag(int(user_id), tag)
+    print(f"Тег {tag} {'добавлен' if command == 'tag' else 'удален'}: {len(user_ids)} пользователей")
+
+
 async def main():
+    # python manual_mailing.py                             - новая рассылка всем подписчикам
+    # python manual_mailing.py segment "<запрос>"          - рассылка по сегменту, например "tag = ML and stage >= 2"
+    # python manual_mailing.py resume <snapshot_id> <id>   - продолжить прерванную рассылку по сегменту
+    # python manual_mailing.py edit <id>                   - заменить текст уже отправленной рассылки на текущий
+    # python manual_mailing.py delete <id>                 - отозвать рассылку
+    # python manual_mailing.py tag|untag <тег> <user_id>...       - теги для сегментов
+    # python manual_mailing.py attr <ключ> <значение> <user_id>... - атрибуты для сегментов (например, promo_code)
+    command = sys.argv[1] if len(sys.argv) > 1 else "send"
+    await create_table()
+
+    if command in ("tag", "untag", "attr"):
+        await manage_audience(command, sys.argv[2:])
+        return
+
     bot = Bot(token=BOT_TOKEN)
 
     # Данные для рассылки
     image_url = "https://example.com/new-course.jpg"  # Замените на реальную ссылку
-    text = """🔥 <b>Новый курс по Machine Learning!</b>
+    # Текст - шаблон: {first_name|...} подставляется для каждого получателя
+    text = """🔥 <b>{first_name|Друг}, новый курс по Machine Learning!</b>
 
 Освойте одну из самых востребованных профессий 2024 года!
 
@@ -28,8 +62,21 @@ async def main():
 
     button_url = "https://example.com/ml-course"  # Замените на реальную ссылку
 
-    success_count = await broadcast_message(bot, image_url, text, button_url, "Записаться на курс")
-    print(f"Рассылка отправлена {success_count} пользователям")
+    if command == "edit":
+        await edit_campaign(bot, int(sys.argv[2]), text, button_url, "Записаться на курс")
+    elif command == "delete":
+        await delete_campaign(bot, int(sys.argv[2]))
+    elif command == "segment":
+        success_count = await broadcast_message(bot, image_url, text, button_url, "Записаться на курс",
+                                                segment=sys.argv[2])
+        print(f"Рассылка отправлена {success_count} пользователям сегмента")
+    elif command == "resume":
+        success_count = await broadcast_message(bot, image_url, text, button_url, "Записаться на курс",
+                                                snapshot_id=int(sys.argv[2]), campaign_id=int(sys.argv[3]))
+        print(f"Рассылка продолжена: отправлено еще {success_count} пользователям")
+    else:
+        success_count = await broadcast_message(bot, image_url, text, button_url, "Записаться на курс")
+        print(f"Рассылка отправлена {success_count} пользователям")
 
     await bot.session.close()
 
@@ -0,0 +1,42 @@
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import POLLING_STATE_PATH, POLLING_LIMIT, POLLING_TIMEOUT, POLLING_MAX_IN_FLIGHT
+from app import bot, dp, logger, setup_dispatcher, init_database, start_scheduler
+from services.polling import PollingRunner, UpdateJournal
+
+
+async def main():
+    """Запуск бота в режиме long polling (локально, за NAT или с локальным Bot API)"""
+    setup_dispatcher()
+    await init_database()
+
+    # getUpdates не работает, пока установлен вебхук
+    await bot.delete_webhook(drop_pending_updates=False)
+    logger.info("✅ Вебхук удален, переходим на polling")
+
+    scheduler = start_scheduler()
+    runner = PollingRunner(
+        bot,
+        dp,
+        UpdateJournal(POLLING_STATE_PATH),
+        limit=POLLING_LIMIT,
+        timeout=POLLING_TIMEOUT,
+        max_in_flight=POLLING_MAX_IN_FLIGHT
+    )
+
+    try:
+        await runner.run()
+    finally:
+        scheduler.shutdown(wait=False)
+        await bot.session.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("🛑 Polling остановлен")
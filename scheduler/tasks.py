@@ -2,7 +2,9 @@ import logging
 from aiogram import Bot
 from aiogram.enums import ParseMode
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from database.db import get_pending_messages, mark_message_sent, update_welcome_stage, WELCOME_MESSAGES
+from database.db import (get_pending_messages, get_subscriber_profiles, mark_message_sent, update_welcome_stage,
+                         WELCOME_MESSAGES)
+from services.welcome import WELCOME_TEMPLATES
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +15,15 @@ async def send_scheduled_welcome(bot: Bot):
         pending_messages = await get_pending_messages()
         logger.info(f"Найдено сообщений для отправки: {len(pending_messages)}")
 
+        # Данные для персонализации - одним запросом на всю пачку
+        profiles = await get_subscriber_profiles({message[1] for message in pending_messages})
+
         for message in pending_messages:
             message_id, user_id, message_stage, username = message
 
             if message_stage < len(WELCOME_MESSAGES):
                 msg_data = WELCOME_MESSAGES[message_stage]
+                text = WELCOME_TEMPLATES[message_stage].render(profiles.get(user_id))
 
                 # Создаем клавиатуру с кнопкой если есть
                 keyboard = None
@@ -35,14 +41,14 @@ async def send_scheduled_welcome(bot: Bot):
                         await bot.send_photo(
                             chat_id=user_id,
                             photo=msg_data['image'],
-                            caption=msg_data['text'],
+                            caption=text,
                             reply_markup=keyboard,
                             parse_mode=ParseMode.HTML
                         )
                     else:
                         await bot.send_message(
                             chat_id=user_id,
-                            text=msg_data['text'],
+                            text=text,
                             reply_markup=keyboard,
                             parse_mode=ParseMode.HTML
                         )
@@ -1,40 +1,201 @@
+import asyncio
 from aiogram import Bot
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.enums import ParseMode
-from database.db import get_all_subscribers
+from aiogram.exceptions import TelegramBadRequest
+from typing import Optional
+from database.db import (iter_subscribers, create_campaign, finish_campaign, get_campaign, get_subscriber_profiles,
+                         update_campaign, add_campaign_messages, iter_campaign_messages,
+                         delete_campaign_messages, get_sent_chat_ids,
+                         create_segment_snapshot, iter_segment, update_segment_cursor)
+from services.pipeline import run_pipeline, DEFAULT_RATE
+from services.templates import compile_template
+
+
+def _keyboard(button_url: Optional[str], button_text: Optional[str]):
+    if not button_url:
+        return None
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text=button_text or "Узнать подробнее", url=button_url)]]
+    )
+
+
+async def _with_profiles(batches, template, profiles: dict, key=lambda item: item):
+    """Подгрузка данных для персонализации перед каждой пачкой (если шаблон их использует)"""
+    async for batch in batches:
+        if template.fields:
+            profiles.clear()
+            profiles.update(await get_subscriber_profiles([key(item) for item in batch]))
+        yield batch
+
+
+async def _skip_sent(batches, campaign_id: int):
+    """Пропуск получателей, которым сообщение рассылки уже записано (при продолжении)"""
+    async for batch in batches:
+        sent = await get_sent_chat_ids(campaign_id, batch)
+        batch = [user_id for user_id in batch if user_id not in sent]
+        if batch:
+            yield batch
 
 
 async def broadcast_message(bot: Bot, image_url: str, text: str, button_url: str,
-                            button_text: str = "Узнать подробнее"):
-    """Функция для массовой рассылки сообщения всем подписчикам"""
-    subscribers = await get_all_subscribers()
-
-    keyboard = None
-    if button_url:
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text=button_text, url=button_url)]]
+                            button_text: str = "Узнать подробнее",
+                            segment: Optional[str] = None, snapshot_id: Optional[int] = None,
+                            campaign_id: Optional[int] = None, rate: float = DEFAULT_RATE):
+    """Функция для массовой рассылки сообщения всем подписчикам.
+
+    segment - запрос сегмента аудитории (например, "tag = ML and stage >= 2"),
+    snapshot_id и campaign_id - продолжение прерванной рассылки по уже
+    созданному снимку: новые сообщения дописываются в ту же рассылку.
+    Текст - шаблон с подстановками {first_name}, {username}, {stage},
+    {promo_code} (см. services.templates); компилируется один раз до рассылки.
+    Отправленные сообщения сохраняются, чтобы рассылку можно было
+    исправить (edit_campaign) или отозвать (delete_campaign).
+    rate - лимит сообщений в секунду (выше 30 - только с платными рассылками).
+    """
+    template = compile_template(text, caption=bool(image_url))
+    if campaign_id is not None and snapshot_id is None:
+        raise ValueError("Продолжить можно только рассылку по снимку сегмента: передайте snapshot_id")
+
+    if segment is not None and snapshot_id is None:
+        snapshot_id = await create_segment_snapshot(segment)
+    if snapshot_id is not None:
+        batches = iter_segment(snapshot_id)
+    else:
+        batches = iter_subscribers()
+
+    sent_total = 0
+    if campaign_id is None:
+        campaign_id = await create_campaign(text, image_url, button_url, button_text)
+    else:
+        campaign = await get_campaign(campaign_id)
+        if campaign is None:
+            raise ValueError(f"Рассылка {campaign_id} не найдена")
+        sent_total = campaign[5]
+        # Прерванная пачка могла успеть разослать часть сообщений: не отправляем их повторно
+        batches = _skip_sent(batches, campaign_id)
+    if snapshot_id is not None:
+        print(f"Рассылка {campaign_id} по снимку сегмента {snapshot_id} "
+              f"(для продолжения передайте snapshot_id={snapshot_id}, campaign_id={campaign_id})")
+    keyboard = _keyboard(button_url, button_text)
+    profiles = {}
+
+    async def send(user_id: int):
+        rendered = template.render(profiles.get(user_id))
+        if image_url:
+            return await bot.send_photo(
+                chat_id=user_id,
+                photo=image_url,
+                caption=rendered,
+                reply_markup=keyboard,
+                parse_mode=ParseMode.HTML
+            )
+        return await bot.send_message(
+            chat_id=user_id,
+            text=rendered,
+            reply_markup=keyboard,
+            parse_mode=ParseMode.HTML
         )
 
-    success_count = 0
-    for user_id in subscribers:
+    async def save_batch(results):
+        nonlocal sent_total
+        sent = []
+        interrupted = False
+        for user_id, message, error in results:
+            if error is None:
+                sent.append((user_id, message.message_id))
+            elif isinstance(error, asyncio.CancelledError):
+                interrupted = True
+            else:
+                print(f"Не удалось отправить сообщение {user_id}: {error}")
+        # Одна запись на пачку: id сообщений, счётчик отправленных и позиция в снимке.
+        # Курсор прерванной пачки не двигаем - при продолжении уже отправленные пропустит _skip_sent
+        await add_campaign_messages(campaign_id, sent)
+        sent_total += len(sent)
+        await finish_campaign(campaign_id, sent_total)
+        if snapshot_id is not None and not interrupted:
+            await update_segment_cursor(snapshot_id, results[-1][0])
+
+    success_count, _ = await run_pipeline(_with_profiles(batches, template, profiles), send, save_batch, rate)
+
+    print(f"Рассылка {campaign_id} завершена: {success_count} получателей ({sent_total} всего)")
+    return success_count
+
+
+async def edit_campaign(bot: Bot, campaign_id: int, text: str,
+                        button_url: Optional[str] = None, button_text: Optional[str] = None,
+                        rate: float = DEFAULT_RATE):
+    """Исправление уже отправленной рассылки у всех получателей.
+
+    Текст - такой же шаблон, как в broadcast_message. Кнопка по умолчанию
+    остаётся прежней: без reply_markup Telegram убрал бы её из сообщения.
+    Возвращает (исправлено, с ошибкой).
+    """
+    campaign = await get_campaign(campaign_id)
+    if campaign is None:
+        raise ValueError(f"Рассылка {campaign_id} не найдена")
+    _, _, image_url, old_button_url, old_button_text, _ = campaign
+
+    template = compile_template(text, caption=bool(image_url))
+    button_url, button_text = button_url or old_button_url, button_text or old_button_text
+    keyboard = _keyboard(button_url, button_text)
+    profiles = {}
+
+    async def edit(record):
+        chat_id, message_id = record
+        rendered = template.render(profiles.get(chat_id))
         try:
             if image_url:
-                await bot.send_photo(
-                    chat_id=user_id,
-                    photo=image_url,
-                    caption=text,
+                await bot.edit_message_caption(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    caption=rendered,
                     reply_markup=keyboard,
                     parse_mode=ParseMode.HTML
                 )
             else:
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=text,
+                await bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=rendered,
                     reply_markup=keyboard,
                     parse_mode=ParseMode.HTML
                 )
-            success_count += 1
-        except Exception as e:
-            print(f"Не удалось отправить сообщение {user_id}: {e}")
+        except TelegramBadRequest as e:
+            # Повторный запуск правки: сообщение уже в нужном виде
+            if "message is not modified" not in str(e):
+                raise
+
+    async def report(results):
+        for (chat_id, _), _, error in results:
+            if error is not None and not isinstance(error, asyncio.CancelledError):
+                print(f"Не удалось исправить сообщение у {chat_id}: {error}")
+
+    batches = _with_profiles(iter_campaign_messages(campaign_id), template, profiles, key=lambda record: record[0])
+    edited, failed = await run_pipeline(batches, edit, report, rate)
+    await update_campaign(campaign_id, text, button_url, button_text)
+    print(f"Рассылка {campaign_id} исправлена: {edited} сообщений, ошибок: {failed}")
+    return edited, failed
+
+
+async def delete_campaign(bot: Bot, campaign_id: int, rate: float = DEFAULT_RATE):
+    """Отзыв рассылки: удаление отправленных сообщений у всех получателей.
+
+    Telegram позволяет боту удалять свои сообщения в личных чатах только в
+    течение 48 часов. Записи об удалённых сообщениях стираются, поэтому
+    повторный запуск обходит только то, что удалить не удалось.
+    Возвращает (удалено, с ошибкой).
+    """
+    async def delete(record):
+        chat_id, message_id = record
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+    async def report(results):
+        for (chat_id, _), _, error in results:
+            if error is not None and not isinstance(error, asyncio.CancelledError):
+                print(f"Не удалось удалить сообщение у {chat_id}: {error}")
+        await delete_campaign_messages(campaign_id, [chat_id for (chat_id, _), _, error in results if error is None])
 
-    return success_count
\ No newline at end of file
+    deleted, failed = await run_pipeline(iter_campaign_messages(campaign_id), delete, report, rate)
+    print(f"Рассылка {campaign_id} отозвана: удалено {deleted} сообщений, ошибок: {failed}")
+    return deleted, failed
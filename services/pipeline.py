@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram допускает около 30 сообщений в секунду при рассылке разным пользователям
+DEFAULT_RATE = 25
+DEFAULT_CONCURRENCY = 20
+MAX_RETRIES = 3
+
+
+class RateLimiter:
+    """Равномерный лимит запросов в секунду с общей паузой по RetryAfter"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_slot = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(self._next_slot, now) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Сдвиг всех следующих запросов (Telegram попросил подождать)"""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+async def run_pipeline(batches: AsyncIterator[List[Any]],
+                       action: Callable[[Any], Awaitable[Any]],
+                       on_batch_done: Optional[Callable[[List[Tuple[Any, Any, Optional[Exception]]]], Awaitable]] = None,
+                       rate: float = DEFAULT_RATE,
+                       concurrency: int = DEFAULT_CONCURRENCY) -> Tuple[int, int]:
+    """Выполнение action для каждого элемента пачек с лимитом скорости и параллельности.
+
+    После каждой пачки on_batch_done получает список (элемент, результат,
+    ошибка) - там удобно сохранять результаты и курсор одним запросом.
+    Если выполнение прервано (отмена, Ctrl+C), on_batch_done всё равно
+    вызывается для текущей пачки: незавершённые элементы приходят с ошибкой
+    asyncio.CancelledError, чтобы уже выполненные действия не потерялись.
+    Возвращает (успешно, с ошибкой).
+    """
+    limiter = RateLimiter(rate)
+    slots = asyncio.Semaphore(concurrency)
+    ok_count = failed_count = 0
+
+    async def run_one(item):
+        async with slots:
+            for attempt in range(MAX_RETRIES + 1):
+                await limiter.acquire()
+                try:
+                    return item, await action(item), None
+                except TelegramRetryAfter as e:
+                    if attempt == MAX_RETRIES:
+                        return item, None, e
+                    logger.warning(f"Flood control: пауза {e.retry_after} с")
+                    limiter.pause(e.retry_after)
+                except Exception as e:
+                    return item, None, e
+
+    async for batch in batches:
+        tasks = [asyncio.ensure_future(run_one(item)) for item in batch]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            results = []
+            for item, task in zip(batch, tasks):
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    results.append(task.result())
+                else:
+                    task.cancel()
+                    results.append((item, None, asyncio.CancelledError()))
+            for _, _, error in results:
+                if error is None:
+                    ok_count += 1
+                elif not isinstance(error, asyncio.CancelledError):
+                    failed_count += 1
+            if on_batch_done is not None:
+                await on_batch_done(results)
+
+    return ok_count, failed_count
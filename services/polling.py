@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateJournal:
+    """Журнал апдейтов в SQLite: смещение getUpdates и необработанные апдейты.
+
+    Пачка апдейтов записывается в журнал вместе с новым смещением одной
+    транзакцией до того, как смещение уйдёт в Telegram (тем самым
+    подтверждая апдейты), с synchronous = FULL - запись переживает и
+    отключение питания. Обработанные апдейты удаляются из журнала пачкой
+    перед каждым getUpdates и раз в секунду; оставшиеся после перезапуска
+    обрабатываются заново. Так апдейты не теряются, а повторно может
+    выполниться лишь то, что завершилось после последнего удаления.
+    """
+
+    def __init__(self, path: str = 'polling_state.db'):
+        self.path = path
+        self._db: Optional[aiosqlite.Connection] = None
+
+    async def open(self):
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.execute("PRAGMA journal_mode = WAL")
+        await self._db.execute("PRAGMA synchronous = FULL")
+        await self._db.execute('''
+            CREATE TABLE IF NOT EXISTS polling_state (
+                key TEXT PRIMARY KEY,
+                value INTEGER
+            )
+        ''')
+        await self._db.execute('''
+            CREATE TABLE IF NOT EXISTS pending_updates (
+                update_id INTEGER PRIMARY KEY,
+                payload TEXT
+            )
+        ''')
+        await self._db.commit()
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def get_offset(self) -> Optional[int]:
+        cursor = await self._db.execute("SELECT value FROM polling_state WHERE key = 'offset'")
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def get_pending(self) -> List[Tuple[int, str]]:
+        cursor = await self._db.execute("SELECT update_id, payload FROM pending_updates ORDER BY update_id")
+        return await cursor.fetchall()
+
+    async def store_batch(self, updates: List[Update], offset: int):
+        """Запись пачки и нового смещения одной транзакцией"""
+        await self._db.executemany(
+            "INSERT OR IGNORE INTO pending_updates (update_id, payload) VALUES (?, ?)",
+            [(update.update_id, update.model_dump_json(exclude_unset=True)) for update in updates]
+        )
+        await self._db.execute(
+            "INSERT OR REPLACE INTO polling_state (key, value) VALUES ('offset', ?)",
+            (offset,)
+        )
+        await self._db.commit()
+
+    async def complete(self, update_ids: List[int]):
+        await self._db.executemany(
+            "DELETE FROM pending_updates WHERE update_id = ?",
+            [(update_id,) for update_id in update_ids]
+        )
+        await self._db.commit()
+
+
+def _chat_key(update: Update) -> Optional[int]:
+    """Ключ упорядочивания: чат (или пользователь) апдейта"""
+    try:
+        event = update.event
+    except Exception:
+        return None
+    chat = getattr(event, 'chat', None)
+    if chat is None:
+        chat = getattr(getattr(event, 'message', None), 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+    return user.id if user is not None else None
+
+
+class PollingRunner:
+    """Long polling с конкурентной обработкой пачек.
+
+    Апдейты разных чатов обрабатываются параллельно, апдейты одного чата -
+    строго по очереди. Семафор ограничивает число апдейтов в работе: когда
+    лимит исчерпан, новые пачки не запрашиваются, и память не растёт.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, journal: UpdateJournal,
+                 limit: int = 100, timeout: int = 50, max_in_flight: int = 1000):
+        self.bot = bot
+        self.dp = dp
+        self.journal = journal
+        self.limit = limit
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._chat_queues: Dict[int, deque] = {}
+        self._tasks = set()
+        self._completed: List[int] = []
+
+    async def run(self):
+        await self.journal.open()
+        try:
+            # Сначала дорабатываем то, что не успели обработать до перезапуска
+            pending = await self.journal.get_pending()
+            if pending:
+                logger.info(f"♻️ Повторная обработка {len(pending)} апдейтов из журнала")
+            for _, payload in pending:
+                update = Update.model_validate_json(payload, context={"bot": self.bot})
+                await self._submit(update)
+
+            flusher = asyncio.create_task(self._flush_loop())
+            try:
+                await self._poll(await self.journal.get_offset())
+            finally:
+                flusher.cancel()
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._flush_completed()
+            await self.journal.close()
+
+    async def _poll(self, offset: Optional[int]):
+        allowed_updates = self.dp.resolve_used_update_types()
+        backoff = 1
+        logger.info(f"🔄 Запуск polling (offset={offset}, limit={self.limit}, in-flight={self.max_in_flight})")
+
+        while True:
+            # Следующий getUpdates подтвердит пачку в Telegram - сначала фиксируем завершённые апдейты,
+            # чтобы при сбое не обрабатывать их повторно (/start не идемпотентен)
+            await self._flush_completed()
+            try:
+                updates = await self.bot.get_updates(
+                    offset=offset,
+                    limit=self.limit,
+                    timeout=self.timeout,
+                    allowed_updates=allowed_updates,
+                    request_timeout=self.timeout + 10
+                )
+                backoff = 1
+            except Exception as e:
+                logger.error(f"❌ Ошибка getUpdates: {e}, повтор через {backoff} с")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            if not updates:
+                continue
+
+            offset = updates[-1].update_id + 1
+            await self.journal.store_batch(updates, offset)
+            for update in updates:
+                await self._submit(update)
+
+    async def _submit(self, update: Update):
+        await self._slots.acquire()
+        key = _chat_key(update)
+        if key is None:
+            self._spawn(self._process_one(update))
+            return
+
+        queue = self._chat_queues.get(key)
+        if queue is not None:
+            # Для чата уже работает обработчик - он заберёт апдейт после текущих
+            queue.append(update)
+            return
+        self._chat_queues[key] = deque([update])
+        self._spawn(self._process_chat(key))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process_chat(self, key: int):
+        queue = self._chat_queues[key]
+        try:
+            while queue:
+                await self._process_one(queue[0])
+                queue.popleft()
+        finally:
+            del self._chat_queues[key]
+
+    async def _process_one(self, update: Update):
+        try:
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки апдейта {update.update_id}: {e}")
+            # При отмене апдейт остаётся в журнале и будет обработан после перезапуска
+            self._completed.append(update.update_id)
+        finally:
+            self._slots.release()
+
+    async def _flush_loop(self, interval: float = 1.0):
+        """Периодическое удаление обработанных апдейтов из журнала"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._flush_completed()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи журнала апдейтов: {e}")
+
+    async def _flush_completed(self):
+        if self._completed:
+            completed, self._completed = self._completed, []
+            await self.journal.complete(completed)
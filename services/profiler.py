@@ -0,0 +1,198 @@
+import asyncio
+import cProfile
+import io
+import marshal
+import math
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+MAX_DURATION_SECONDS = 120
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Статистический профайлер: периодически снимает стек одного потока.
+
+    Работает в отдельном потоке и не вмешивается в выполнение кода, поэтому
+    накладные расходы ограничены частотой опроса. Результат - collapsed stacks
+    (формат flamegraph.pl / speedscope): "корень;...;лист количество".
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.reverse()
+            self.stacks[";".join(labels)] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class _ProfiledCoroutine:
+    """Обёртка корутины: профайлер включён только на шагах этой корутины.
+
+    Пока обёрнутая корутина ждёт (await), цикл событий выполняет другие
+    задачи, и в этот момент профайлер выключен - в статистику попадает
+    только работа самого апдейта.
+    """
+
+    def __init__(self, coro, profile: cProfile.Profile):
+        self._coro = coro
+        self._profile = profile
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        self._profile.enable()
+        try:
+            return self._coro.send(value)
+        finally:
+            self._profile.disable()
+
+    def throw(self, *args):
+        self._profile.enable()
+        try:
+            return self._coro.throw(*args)
+        finally:
+            self._profile.disable()
+
+    def close(self):
+        return self._coro.close()
+
+
+class UpdateProfilerMiddleware:
+    """Outer-middleware диспетчера: cProfile для случайной доли апдейтов.
+
+    Профайлер включается только на шагах обработчика выбранного апдейта,
+    поэтому другие задачи цикла событий в отчёт не попадают. Одновременно
+    профилируется не больше одного апдейта, остальные проходят без замеров.
+    """
+
+    def __init__(self, sample_rate: float):
+        self.sample_rate = sample_rate
+        self.stats: Optional[pstats.Stats] = None
+        self.profiled = 0
+        self._busy = False
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        if self._busy or random.random() >= self.sample_rate:
+            return await handler(event, data)
+
+        self._busy = True
+        profile = cProfile.Profile()
+        try:
+            return await _ProfiledCoroutine(handler(event, data), profile)
+        finally:
+            self._busy = False
+            self.profiled += 1
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def report(self, sort_by: str = "cumulative", limit: int = 60) -> str:
+        if self.stats is None:
+            return "Нет профилированных апдейтов"
+        stream = io.StringIO()
+        self.stats.stream = stream
+        self.stats.sort_stats(sort_by).print_stats(limit)
+        return stream.getvalue()
+
+    def dump(self) -> bytes:
+        """Сырые данные в формате pstats (как Stats.dump_stats) для snakeviz/flameprof"""
+        return marshal.dumps(self.stats.stats if self.stats is not None else {})
+
+
+class ProfilerSession:
+    """Ограниченная по времени сессия профилирования.
+
+    Пока сессия не запущена, ни поток-сэмплер, ни middleware не существуют,
+    так что в обычном режиме профайлер ничего не стоит.
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.running = False
+
+    async def run(self, mode: str = "stacks", duration: float = 10.0,
+                  interval: float = 0.005, sample_rate: float = 0.1,
+                  raw: bool = False) -> Union[str, bytes]:
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+        if mode not in ("stacks", "cprofile"):
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        if not all(math.isfinite(value) for value in (duration, interval, sample_rate)):
+            raise ValueError("Параметры профилирования должны быть конечными числами")
+        duration = min(max(duration, 0.1), MAX_DURATION_SECONDS)
+
+        self.running = True
+        try:
+            if mode == "stacks":
+                return await self._run_sampler(duration, interval)
+            return await self._run_cprofile(duration, sample_rate, raw)
+        finally:
+            self.running = False
+
+    async def _run_sampler(self, duration: float, interval: float) -> str:
+        sampler = StackSampler(threading.get_ident(), max(interval, 0.001))
+        started = time.monotonic()
+        sampler.start()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, sampler.stop)
+        elapsed = time.monotonic() - started
+        header = f"# samples={sampler.samples} interval={sampler.interval}s elapsed={elapsed:.1f}s"
+        return f"{header}\n{sampler.collapsed()}\n"
+
+    async def _run_cprofile(self, duration: float, sample_rate: float, raw: bool) -> Union[str, bytes]:
+        middleware = UpdateProfilerMiddleware(min(max(sample_rate, 0.0), 1.0))
+        self.dispatcher.update.outer_middleware.register(middleware)
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self.dispatcher.update.outer_middleware.unregister(middleware)
+        if raw:
+            return middleware.dump()
+        header = f"# profiled updates={middleware.profiled} sample_rate={middleware.sample_rate}"
+        return f"{header}\n{middleware.report()}"
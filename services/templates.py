@@ -0,0 +1,158 @@
+import html
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# Лимиты Telegram на длину текста после разбора HTML-разметки (в UTF-16)
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+# Поля подстановки и их максимальная длина в единицах UTF-16: на неё опирается
+# проверка лимита при компиляции, и до неё же обрезаются значения при рендере.
+# first_name в Telegram - до 64 символов, то есть до 128 единиц UTF-16
+FIELD_MAX_LENGTHS = {
+    'first_name': 128,
+    'username': 32,
+    'stage': 4,
+    'promo_code': 32,
+}
+
+_TAG_RE = re.compile(r'<[^>]+>')
+# {{ и }} - литеральные скобки, {имя|значение по умолчанию} - подстановка, остальные скобки - ошибка
+_PLACEHOLDER_RE = re.compile(r'\{\{|\}\}|\{([^{}]*)\}|[{}]')
+
+
+class TemplateError(ValueError):
+    """Ошибка компиляции шаблона"""
+
+
+def _visible_length(text: str) -> int:
+    """Длина текста, которую увидит Telegram: без тегов, в единицах UTF-16"""
+    visible = html.unescape(_TAG_RE.sub('', text))
+    return len(visible.encode('utf-16-le')) // 2
+
+
+def _escape(value, limit: int) -> str:
+    """Обрезка до limit единиц UTF-16 и html.escape без кавычек, с быстрым путём для коротких строк"""
+    if value.__class__ is not str:
+        value = str(value)
+    if len(value) * 2 > limit:
+        encoded = value.encode('utf-16-le')
+        if len(encoded) > limit * 2:
+            # Половинку суррогатной пары на границе отбрасываем
+            value = encoded[:limit * 2].decode('utf-16-le', errors='ignore')
+    if '&' in value or '<' in value or '>' in value:
+        return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return value
+
+
+class CompiledTemplate:
+    """Шаблон, разобранный один раз в специализированную функцию рендера.
+
+    Подстановки вида {first_name} или {first_name|друг} (значение по
+    умолчанию для пустого поля) превращаются в позиционную строку формата,
+    значения обрезаются до FIELD_MAX_LENGTHS и экранируются для parse_mode=HTML. Готовые тексты для
+    одинаковых наборов значений берутся из ограниченного кэша.
+    """
+
+    def __init__(self, source: str, fields: Tuple[str, ...], defaults: Tuple[str, ...],
+                 fmt: str, cache_size: int):
+        self.source = source
+        self.fields = fields
+        self.cache_size = cache_size
+        self._cache = {}
+        self.render = self._build_render(fields, defaults, fmt)
+
+    def _build_render(self, fields, defaults, fmt):
+        if not fields:
+            static = fmt.format()
+            return lambda context=None: static
+
+        # Генерируем функцию под конкретный набор полей: без циклов и zip на каждого получателя
+        values = [f"v{i}" for i in range(len(fields))]
+        lines = ["def render(context=None):",
+                 "    if context is None:",
+                 "        context = EMPTY"]
+        lines += [f"    v{i} = context.get({field!r})" for i, field in enumerate(fields)]
+        key = f"({', '.join(values)},)"
+        args = ", ".join(f"escape(v{i}, {FIELD_MAX_LENGTHS[field]}) if v{i} is not None and v{i} != '' else d{i}" for i, field in enumerate(fields))
+        lines += [f"    key = {key}",
+                  "    text = cache.get(key)",
+                  "    if text is None:",
+                  f"        text = fmt({args})",
+                  "        if len(cache) < cache_size:",
+                  "            cache[key] = text",
+                  "    return text"]
+        namespace = {"EMPTY": {}, "escape": _escape, "cache": self._cache,
+                     "cache_size": self.cache_size, "fmt": fmt.format}
+        namespace.update({f"d{i}": default for i, default in enumerate(defaults)})
+        exec("\n".join(lines), namespace)
+        return namespace["render"]
+
+    def cache_clear(self):
+        self._cache.clear()
+
+
+def _parse(text: str) -> List[Tuple[str, Optional[str], str]]:
+    """Разбор шаблона на части (литерал, поле или None, значение по умолчанию).
+
+    Разбираем вручную, а не через string.Formatter: в значении по
+    умолчанию допустимы любые символы, кроме фигурных скобок, включая ! и :
+    (например, {first_name|Привет!}).
+    """
+    parts = []
+    literal = []
+    pos = 0
+    for match in _PLACEHOLDER_RE.finditer(text):
+        literal.append(text[pos:match.start()])
+        pos = match.end()
+        token = match.group(0)
+        if token in ('{{', '}}'):
+            literal.append(token[0])
+            continue
+        field = match.group(1)
+        if field is None:
+            kind = "незакрытая" if token == '{' else "непарная"
+            raise TemplateError(f"В шаблоне {kind} скобка {token!r} на позиции {match.start()}; "
+                                f"для литеральной скобки используйте {token * 2!r}")
+        name, _, default = field.partition('|')
+        name = name.strip()
+        if not name:
+            raise TemplateError(f"Пустое имя поля в подстановке {token!r} на позиции {match.start()}")
+        if ':' in name or '!' in name:
+            raise TemplateError(f"Форматирование полей не поддерживается: {token!r}; "
+                                f"символы ! и : допустимы только в значении по умолчанию после |")
+        parts.append((''.join(literal), name, default))
+        literal = []
+    literal.append(text[pos:])
+    parts.append((''.join(literal), None, ''))
+    return parts
+
+
+@lru_cache(maxsize=256)
+def compile_template(text: str, caption: bool = False, cache_size: int = 4096) -> CompiledTemplate:
+    """Разбор и проверка шаблона; повторная компиляция того же текста берётся из кэша"""
+    fields, defaults, chunks = [], [], []
+    visible_parts = []
+    worst_case_fields = 0
+
+    for literal, name, default in _parse(text):
+        chunks.append(literal.replace('{', '{{').replace('}', '}}'))
+        visible_parts.append(literal)
+        if name is None:
+            continue
+        if name not in FIELD_MAX_LENGTHS:
+            raise TemplateError(f"Неизвестное поле шаблона: {name!r}")
+
+        default = html.escape(default, quote=False)
+        chunks.append(f"{{{len(fields)}}}")
+        fields.append(name)
+        defaults.append(default)
+        worst_case_fields += max(FIELD_MAX_LENGTHS[name], _visible_length(default))
+
+    limit = CAPTION_LIMIT if caption else MESSAGE_LIMIT
+    worst_case = _visible_length(''.join(visible_parts)) + worst_case_fields
+    if worst_case > limit:
+        raise TemplateError(f"Текст может превысить лимит Telegram: до {worst_case} символов при лимите {limit}")
+
+    return CompiledTemplate(text, tuple(fields), tuple(defaults), ''.join(chunks), cache_size)
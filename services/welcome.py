@@ -0,0 +1,8 @@
+from database.db import WELCOME_MESSAGES
+from services.templates import compile_template
+
+# Тексты приветствий компилируются один раз при импорте (с проверкой лимитов Telegram)
+WELCOME_TEMPLATES = [
+    compile_template(msg["text"], caption=bool(msg.get("image")))
+    for msg in WELCOME_MESSAGES
+]
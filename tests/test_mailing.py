@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from database.db import (create_segment_snapshot, get_campaign, get_segment_snapshot, iter_campaign_messages,
+                         set_attribute, set_storage)
+from database.memory_storage import MemoryStorage
+from services.mailing import broadcast_message, delete_campaign, edit_campaign
+
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class FakeBot:
+    """Бот без сети: message_id = chat_id * 10, получатели из blocked зависают до отмены"""
+
+    def __init__(self, blocked=(), undeletable=(), failing=(), flood=()):
+        self.blocked = set(blocked)
+        self.undeletable = set(undeletable)
+        self.failing = set(failing)
+        self.flood = set(flood)
+        self.sent = []
+        self.texts = {}
+        self.photos = []
+        self.edited = []
+        self.deleted = []
+        self.waiting = 0
+
+    async def send_message(self, chat_id, text, reply_markup=None, parse_mode=None):
+        if chat_id in self.blocked:
+            self.waiting += 1
+            await asyncio.Event().wait()
+        if chat_id in self.flood:
+            self.flood.discard(chat_id)
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "flood", 0)
+        if chat_id in self.failing:
+            raise RuntimeError("bot was blocked by the user")
+        self.sent.append(chat_id)
+        self.texts[chat_id] = text
+        return FakeMessage(chat_id * 10)
+
+    async def send_photo(self, chat_id, photo, caption, reply_markup=None, parse_mode=None):
+        self.photos.append((chat_id, photo, caption))
+        return await self.send_message(chat_id, caption, reply_markup, parse_mode)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, parse_mode=None):
+        self.edited.append((chat_id, message_id, text))
+
+    async def delete_message(self, chat_id, message_id):
+        if chat_id in self.undeletable:
+            raise RuntimeError("message can't be deleted")
+        self.deleted.append((chat_id, message_id))
+
+
+async def _fill_storage(count):
+    storage = MemoryStorage()
+    set_storage(storage)
+    for user_id in range(1, count + 1):
+        await storage.add_subscriber(user_id, f"user{user_id}", f"Name{user_id}")
+    return storage
+
+
+async def _recorded(campaign_id):
+    return [chat_id async for batch in iter_campaign_messages(campaign_id) for chat_id, _ in batch]
+
+
+async def _wait_for(condition):
+    while not condition():
+        await asyncio.sleep(0.01)
+
+
+def test_cancelled_broadcast_records_sent_and_resume_skips_them():
+    async def run():
+        await _fill_storage(50)
+        # Первые 20 уходят, остальные зависают: отменяем рассылку посреди пачки
+        bot = FakeBot(blocked=range(21, 51))
+        task = asyncio.create_task(broadcast_message(bot, None, "Привет, {first_name}", None,
+                                                     segment="stage = 0", rate=1000))
+        await _wait_for(lambda: len(bot.sent) == 20 and bot.waiting)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert await _recorded(1) == list(range(1, 21))
+        assert (await get_campaign(1))[5] == 20
+
+        resumed = FakeBot()
+        assert await broadcast_message(resumed, None, "Привет, {first_name}", None,
+                                       snapshot_id=1, campaign_id=1, rate=1000) == 30
+        assert sorted(resumed.sent) == list(range(21, 51))
+        assert await _recorded(1) == list(range(1, 51))
+        assert (await get_campaign(1))[5] == 50
+        assert await get_campaign(2) is None
+
+    asyncio.run(run())
+
+
+def test_broadcast_personalises_and_records_messages():
+    async def run():
+        await _fill_storage(6)
+        await set_attribute(2, 'promo_code', '<VIP>')
+        bot = FakeBot(failing={4}, flood={5})
+        sent = await broadcast_message(bot, None, "{first_name}, код {promo_code|NONE}", "https://a", rate=1000)
+        assert sent == 5
+        assert bot.texts[1] == "Name1, код NONE"
+        assert bot.texts[2] == "Name2, код &lt;VIP&gt;"
+        assert 5 in bot.texts
+        assert await _recorded(1) == [1, 2, 3, 5, 6]
+        assert (await get_campaign(1))[5] == 5
+
+    asyncio.run(run())
+
+
+def test_broadcast_with_image_sends_photo():
+    async def run():
+        await _fill_storage(2)
+        bot = FakeBot()
+        await broadcast_message(bot, "https://img", "Привет, {first_name}", None, rate=1000)
+        assert bot.photos == [(1, "https://img", "Привет, Name1"), (2, "https://img", "Привет, Name2")]
+
+    asyncio.run(run())
+
+
+def test_resume_continues_from_cursor():
+    async def run():
+        await _fill_storage(1500)
+        # Первая пачка (1000) завершается целиком, вторая прерывается
+        bot = FakeBot(blocked=range(1201, 1501))
+        task = asyncio.create_task(broadcast_message(bot, None, "Текст", None, segment="stage = 0", rate=100000))
+        await _wait_for(lambda: len(bot.sent) == 1200 and bot.waiting)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert (await get_segment_snapshot(1))[3] == 1000
+
+        resumed = FakeBot()
+        assert await broadcast_message(resumed, None, "Текст", None,
+                                       snapshot_id=1, campaign_id=1, rate=100000) == 300
+        assert sorted(resumed.sent) == list(range(1201, 1501))
+        assert (await get_campaign(1))[5] == 1500
+
+    asyncio.run(run())
+
+
+def test_resume_requires_snapshot_and_existing_campaign():
+    async def run():
+        await _fill_storage(1)
+        with pytest.raises(ValueError):
+            await broadcast_message(FakeBot(), None, "Текст", None, campaign_id=1)
+        snapshot_id = await create_segment_snapshot("stage = 0")
+        with pytest.raises(ValueError):
+            await broadcast_message(FakeBot(), None, "Текст", None, snapshot_id=snapshot_id, campaign_id=7)
+
+    asyncio.run(run())
+
+
+def test_edit_updates_stored_campaign():
+    async def run():
+        await _fill_storage(5)
+        bot = FakeBot()
+        await broadcast_message(bot, None, "Старый текст", "https://a", "Кнопка", rate=1000)
+        assert await edit_campaign(bot, 1, "Новый текст, {first_name}", rate=1000) == (5, 0)
+        assert bot.edited[0] == (1, 10, "Новый текст, Name1")
+        assert await get_campaign(1) == (1, "Новый текст, {first_name}", None, "https://a", "Кнопка", 5)
+
+    asyncio.run(run())
+
+
+def test_delete_forgets_recalled_messages():
+    async def run():
+        await _fill_storage(5)
+        bot = FakeBot(undeletable={3})
+        await broadcast_message(bot, None, "Текст", None, rate=1000)
+        assert await delete_campaign(bot, 1, rate=1000) == (4, 1)
+        assert await _recorded(1) == [3]
+
+        # Повторный отзыв и правка обходят только неудалённое сообщение
+        bot.deleted.clear()
+        bot.undeletable.clear()
+        assert await delete_campaign(bot, 1, rate=1000) == (1, 0)
+        assert bot.deleted == [(3, 30)]
+        assert await edit_campaign(bot, 1, "Текст", rate=1000) == (0, 0)
+        assert bot.edited == []
+
+    asyncio.run(run())
@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from services.pipeline import MAX_RETRIES, RateLimiter, run_pipeline
+
+
+def _flood(seconds):
+    return TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "flood", seconds)
+
+
+async def _batches(*batches):
+    for batch in batches:
+        yield list(batch)
+
+
+def test_rate_limiter_spaces_requests():
+    async def run():
+        limiter = RateLimiter(100)
+        started = time.monotonic()
+        for _ in range(11):
+            await limiter.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_rate_limiter_pause_delays_next_slot():
+    async def run():
+        limiter = RateLimiter(1000)
+        await limiter.acquire()
+        limiter.pause(0.2)
+        started = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.19
+
+
+def test_results_in_batch_order_and_counts():
+    done = []
+
+    async def action(item):
+        await asyncio.sleep(0.001 * (5 - item % 5))
+        if item == 3:
+            raise RuntimeError("blocked")
+        return item * 10
+
+    async def on_batch_done(results):
+        done.append(results)
+
+    ok, failed = asyncio.run(run_pipeline(_batches(range(1, 6), range(6, 8)), action, on_batch_done, rate=1000))
+    assert (ok, failed) == (6, 1)
+    assert [[item for item, _, _ in results] for results in done] == [[1, 2, 3, 4, 5], [6, 7]]
+    assert done[0][1] == (2, 20, None)
+    assert isinstance(done[0][2][2], RuntimeError)
+
+
+def test_concurrency_is_bounded():
+    state = {'now': 0, 'peak': 0}
+
+    async def action(item):
+        state['now'] += 1
+        state['peak'] = max(state['peak'], state['now'])
+        await asyncio.sleep(0.01)
+        state['now'] -= 1
+
+    assert asyncio.run(run_pipeline(_batches(range(50)), action, rate=10000, concurrency=4)) == (50, 0)
+    assert state['peak'] == 4
+
+
+def test_retry_after_pauses_and_retries():
+    calls = []
+
+    async def action(item):
+        calls.append((item, time.monotonic()))
+        if item == 0 and len(calls) == 1:
+            raise _flood(0.2)
+        return item
+
+    async def run():
+        started = time.monotonic()
+        result = await run_pipeline(_batches([0]), action, rate=1000)
+        return result, time.monotonic() - started
+
+    (ok, failed), elapsed = asyncio.run(run())
+    assert (ok, failed) == (1, 0)
+    assert [item for item, _ in calls] == [0, 0]
+    assert elapsed >= 0.19
+
+
+def test_retry_after_gives_up_after_max_retries():
+    calls = []
+    done = []
+
+    async def action(item):
+        calls.append(item)
+        raise _flood(0)
+
+    async def on_batch_done(results):
+        done.extend(results)
+
+    assert asyncio.run(run_pipeline(_batches([1]), action, on_batch_done, rate=1000)) == (0, 1)
+    assert len(calls) == MAX_RETRIES + 1
+    assert isinstance(done[0][2], TelegramRetryAfter)
+
+
+def test_cancel_reports_finished_items():
+    done = []
+
+    async def action(item):
+        if item > 2:
+            await asyncio.Event().wait()
+        return item
+
+    async def on_batch_done(results):
+        done.extend(results)
+
+    async def run():
+        task = asyncio.create_task(run_pipeline(_batches(range(1, 6)), action, on_batch_done, rate=1000))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert [(item, result) for item, result, _ in done[:2]] == [(1, 1), (2, 2)]
+    assert all(isinstance(error, asyncio.CancelledError) for _, _, error in done[2:])
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+pytest.importorskip("aiosqlite")
+
+from aiogram.types import Update
+
+from services.polling import PollingRunner, UpdateJournal
+
+
+def _update(update_id, chat_id):
+    return Update.model_validate({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'text': str(update_id),
+                    'chat': {'id': chat_id, 'type': 'private'}},
+    })
+
+
+class FakeBot:
+    """getUpdates по сценарию: пачки по очереди, затем ожидание до отмены"""
+
+    def __init__(self, *batches):
+        self.batches = list(batches)
+        self.offsets = []
+
+    async def get_updates(self, offset=None, limit=None, timeout=None, allowed_updates=None, request_timeout=None):
+        self.offsets.append(offset)
+        if self.batches:
+            return self.batches.pop(0)
+        await asyncio.Event().wait()
+
+
+class FakeDispatcher:
+    """Обработчик апдейтов: задержка или блокировка по update_id, журнал вызовов"""
+
+    def __init__(self, delays=None, blocked=()):
+        self.delays = delays or {}
+        self.blocked = set(blocked)
+        self.started = []
+        self.finished = []
+        self.in_flight = 0
+        self.peak = 0
+
+    def resolve_used_update_types(self):
+        return ['message']
+
+    async def feed_update(self, bot, update):
+        self.started.append(update.update_id)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            if update.update_id in self.blocked:
+                await asyncio.Event().wait()
+            await asyncio.sleep(self.delays.get(update.update_id, 0))
+        finally:
+            self.in_flight -= 1
+        self.finished.append((update.message.chat.id, update.update_id))
+
+
+async def _run_until(runner, condition):
+    task = asyncio.create_task(runner.run())
+    while not condition():
+        await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_updates_of_one_chat_run_in_order(tmp_path):
+    # Чат 1: медленный первый апдейт, чат 2 не должен его ждать
+    updates = [_update(1, 1), _update(2, 2), _update(3, 1), _update(4, 2), _update(5, 1)]
+    dp = FakeDispatcher(delays={1: 0.1, 3: 0.02})
+    runner = PollingRunner(FakeBot(updates), dp, UpdateJournal(str(tmp_path / 'state.db')))
+
+    asyncio.run(_run_until(runner, lambda: len(dp.finished) == 5))
+    assert [update_id for chat, update_id in dp.finished if chat == 1] == [1, 3, 5]
+    assert [update_id for chat, update_id in dp.finished if chat == 2] == [2, 4]
+    assert dp.finished.index((2, 4)) < dp.finished.index((1, 1))
+
+
+def test_in_flight_is_bounded(tmp_path):
+    updates = [_update(update_id, update_id) for update_id in range(1, 21)]
+    dp = FakeDispatcher(delays={update_id: 0.02 for update_id in range(1, 21)})
+    bot = FakeBot(updates[:10], updates[10:])
+    runner = PollingRunner(bot, dp, UpdateJournal(str(tmp_path / 'state.db')), max_in_flight=3)
+
+    asyncio.run(_run_until(runner, lambda: len(dp.finished) == 20))
+    assert dp.peak == 3
+    assert bot.offsets[:3] == [None, 11, 21]
+
+
+def test_journal_replays_unfinished_updates_after_restart(tmp_path):
+    path = str(tmp_path / 'state.db')
+    dp = FakeDispatcher(blocked={2})
+    runner = PollingRunner(FakeBot([_update(1, 1), _update(2, 2), _update(3, 3)]), dp, UpdateJournal(path))
+    asyncio.run(_run_until(runner, lambda: len(dp.finished) == 2 and 2 in dp.started))
+    assert sorted(update_id for _, update_id in dp.finished) == [1, 3]
+
+    # Перезапуск: апдейт 2 обрабатывается из журнала, 1 и 3 не повторяются, смещение сохранено
+    dp = FakeDispatcher()
+    bot = FakeBot([_update(4, 1)])
+    runner = PollingRunner(bot, dp, UpdateJournal(path))
+    asyncio.run(_run_until(runner, lambda: len(dp.finished) == 2))
+    assert dp.started == [2, 4]
+    assert bot.offsets[0] == 4
+
+    async def pending():
+        journal = UpdateJournal(path)
+        await journal.open()
+        try:
+            return await journal.get_pending()
+        finally:
+            await journal.close()
+
+    assert asyncio.run(pending()) == []
@@ -0,0 +1,144 @@
+import asyncio
+import calendar
+import sqlite3
+import time
+
+import pytest
+
+from database.segments import (SegmentQueryError, compile_predicate, compile_sql,
+                               normalize_attribute_value, parse_segment)
+
+# (user_id, username, stage, subscribed_at, attributes)
+SUBSCRIBERS = [
+    (1, 'anna', 0, '2026-01-05 10:00:00', {'tag': ['ML'], 'age': '10', 'city': 'Москва'}),
+    (2, 'boris', 1, '2026-02-10 12:30:00', {'tag': ['ML', 'AI'], 'age': 25}),
+    (3, 'vera', 2, '2026-03-01 00:00:00', {'tag': ['AI'], 'age': 7.5, 'city': 'Казань'}),
+    (4, None, 3, '2026-03-15 08:00:00', {'age': 'unknown', 'score': '3.5'}),
+    (5, '123', 4, '2026-04-20 18:45:00', {}),
+]
+
+QUERIES = [
+    "stage >= 2",
+    "tag = ML",
+    "tag != ML",
+    "tag = ML or tag = AI",
+    "tag = ML and not tag = AI",
+    "attr.age > 5",
+    "attr.age = 10",
+    'attr.age = "10"',
+    "attr.age < 8",
+    "attr.age > 1000",
+    "attr.age = unknown",
+    "attr.city > 5",
+    "attr.city = Москва",
+    "attr.score >= 3.5",
+    "subscribed >= 2026-03-01",
+    'subscribed < "2026-02-10 12:30" or username = vera',
+    "(stage < 3 and attr.age >= 10) or user_id = 5",
+    "username = 123",
+    "username < 5",
+    "username != vera",
+]
+
+
+def _sql_matches(query):
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE subscribers (user_id INTEGER PRIMARY KEY, username TEXT, "
+               "subscribed_at TIMESTAMP, welcome_stage INTEGER)")
+    db.execute("CREATE TABLE subscriber_attributes (user_id INTEGER, key TEXT, value, "
+               "PRIMARY KEY (user_id, key, value)) WITHOUT ROWID")
+    for user_id, username, stage, subscribed_at, attrs in SUBSCRIBERS:
+        db.execute("INSERT INTO subscribers VALUES (?, ?, ?, ?)", (user_id, username, subscribed_at, stage))
+        for key, values in attrs.items():
+            for value in values if isinstance(values, list) else [values]:
+                db.execute("INSERT INTO subscriber_attributes VALUES (?, ?, ?)",
+                           (user_id, key, normalize_attribute_value(value)))
+    where, params = compile_sql(parse_segment(query))
+    rows = db.execute(f"SELECT s.user_id FROM subscribers s WHERE {where} ORDER BY s.user_id", params)
+    return [row[0] for row in rows]
+
+
+def _predicate_matches(query):
+    predicate = compile_predicate(parse_segment(query))
+    matched = []
+    for user_id, username, stage, subscribed_at, attrs in SUBSCRIBERS:
+        ts = calendar.timegm(time.strptime(subscribed_at, '%Y-%m-%d %H:%M:%S'))
+        normalized = {
+            key: {normalize_attribute_value(v) for v in (values if isinstance(values, list) else [values])}
+            for key, values in attrs.items()
+        }
+        if predicate(user_id, stage, ts, username, normalized):
+            matched.append(user_id)
+    return matched
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_sql_and_predicate_agree(query):
+    assert _sql_matches(query) == _predicate_matches(query)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("attr.age > 5", [1, 2, 3]),
+    ("attr.age = 10", [1]),
+    ('attr.age = "10"', [1]),
+    ("tag != ML", [3, 4, 5]),
+    ("attr.city > 5", []),
+    ("attr.age < zzz", [4]),
+])
+def test_mixed_type_attributes(query, expected):
+    assert _sql_matches(query) == expected
+
+
+def test_numeric_username_is_text():
+    assert _predicate_matches("username = 123") == [5]
+    assert _sql_matches("username = 123") == [5]
+
+
+def test_normalize_attribute_value():
+    assert normalize_attribute_value('10') == 10
+    assert normalize_attribute_value('-2.5') == -2.5
+    assert normalize_attribute_value(True) == 1
+    assert normalize_attribute_value('10a') == '10a'
+
+
+@pytest.mark.parametrize("query", ["", "stage >= x", "foo = 1", "tag > ML", "(stage = 1",
+                                   "stage = 1 stage = 2", "subscribed > yesterday", "stage"])
+def test_invalid_queries(query):
+    with pytest.raises(SegmentQueryError):
+        parse_segment(query)
+
+
+@pytest.mark.parametrize("engine", ["sqlite", "memory", "sharded"])
+def test_engines_materialise_same_segments(engine, tmp_path):
+    pytest.importorskip("aiosqlite")
+    from database.storage import create_storage
+
+    async def run():
+        storage = create_storage(engine, str(tmp_path / 'subscribers.db'), 3)
+        await storage.connect()
+        for user_id in range(1, 31):
+            await storage.add_subscriber(user_id, f"user{user_id}", "Name")
+            await storage.update_welcome_stage(user_id, user_id % 4)
+            if user_id % 3 == 0:
+                await storage.add_tag(user_id, 'ML')
+            await storage.set_attribute(user_id, 'age', str(user_id) if user_id % 2 else user_id)
+        await storage.remove_tag(3, 'ML')
+
+        results = {}
+        for query in ["tag = ML", "stage >= 2 and attr.age > 20", "not tag = ML or attr.age = 7"]:
+            snapshot_id = await storage.create_segment_snapshot(query)
+            members, after = [], 0
+            while True:
+                batch = await storage.get_segment_batch(snapshot_id, after, 4)
+                if not batch:
+                    break
+                members += batch
+                after = batch[-1]
+            assert (await storage.get_segment_snapshot(snapshot_id))[2] == len(members)
+            results[query] = members
+        return results
+
+    results = asyncio.run(run())
+    assert results["tag = ML"] == [6, 9, 12, 15, 18, 21, 24, 27, 30]
+    assert results["stage >= 2 and attr.age > 20"] == [22, 23, 26, 27, 30]
+    assert 7 in results["not tag = ML or attr.age = 7"]
@@ -0,0 +1,154 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from database.storage import create_storage
+
+ENGINES = ["sqlite", "memory", "sharded"]
+
+
+def _run(engine, tmp_path, scenario):
+    async def run():
+        storage = create_storage(engine, str(tmp_path / 'subscribers.db'), 3)
+        await storage.connect()
+        try:
+            return await scenario(storage)
+        finally:
+            await storage.close()
+    return asyncio.run(run())
+
+
+async def _subscribers(storage):
+    for user_id in (7, 3, 12, 1, 8, 5):
+        await storage.add_subscriber(user_id, f"user{user_id}", f"Name{user_id}")
+    await storage.add_subscriber(3, "renamed", "Новое имя")
+    await storage.update_welcome_stage(5, 4)
+    await storage.update_welcome_stage(8, 2)
+    await storage.update_welcome_stage(99, 1)
+    await storage.set_attribute(7, 'promo_code', 'VIP7')
+
+    pages, after = [], 0
+    while True:
+        page = await storage.get_subscribers_batch(after, 2)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]
+
+    return {
+        'all': sorted(await storage.get_all_subscribers()),
+        'pages': pages,
+        'welcome': sorted((user_id, stage) for user_id, stage, _ in await storage.get_subscribers_for_welcome(4)),
+        'profiles': sorted(await storage.get_subscriber_profiles([3, 7, 8, 100])),
+    }
+
+
+async def _scheduled(storage):
+    for user_id in (1, 2, 3, 4, 5):
+        await storage.add_subscriber(user_id, f"user{user_id}", "Name")
+        await storage.add_scheduled_message(user_id, 1, 0)
+        await storage.add_scheduled_message(user_id, 2, 0)
+        await storage.add_scheduled_message(user_id, 3, 60)
+    await storage.add_scheduled_message(42, 1, 0)  # без подписчика - не попадает в выборку
+
+    pending = await storage.get_pending_messages()
+    ids = [row[0] for row in pending]
+    # Отмечаем по глобальному ID только сообщения стадии 1
+    for message_id, _, stage, _ in pending:
+        if stage == 1:
+            await storage.mark_message_sent(message_id)
+    await storage.cleanup_old_messages()
+
+    return {
+        'unique_ids': len(set(ids)) == len(ids),
+        'pending': sorted(row[1:] for row in pending),
+        'after_mark': sorted(row[1:] for row in await storage.get_pending_messages()),
+    }
+
+
+async def _campaigns(storage):
+    first = await storage.create_campaign("Текст", None, "https://a", "Кнопка")
+    second = await storage.create_campaign("Фото", "https://img")
+    await storage.add_campaign_messages(first, [(9, 90), (2, 20), (5, 50)])
+    await storage.add_campaign_messages(first, [(4, 40), (1, 10), (12, 120)])
+    await storage.add_campaign_messages(second, [(3, 30)])
+    await storage.finish_campaign(first, 6)
+    await storage.update_campaign(first, "Исправлено", "https://b", "Новая кнопка")
+    await storage.delete_campaign_messages(first, [4, 9])
+
+    pages, after = [], 0
+    while True:
+        page = await storage.get_campaign_messages(first, after, 2)
+        if not page:
+            break
+        pages.append([tuple(pair) for pair in page])
+        after = page[-1][0]
+
+    return {
+        'ids': (first, second),
+        'first': tuple(await storage.get_campaign(first)),
+        'second': tuple(await storage.get_campaign(second)),
+        'missing': await storage.get_campaign(100),
+        'pages': pages,
+        'other': [tuple(pair) for pair in await storage.get_campaign_messages(second, 0, 10)],
+    }
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_subscribers(engine, tmp_path):
+    result = _run(engine, tmp_path, _subscribers)
+    assert result == {
+        'all': [1, 3, 5, 7, 8, 12],
+        'pages': [[1, 3], [5, 7], [8, 12]],
+        'welcome': [(1, 0), (3, 0), (7, 0), (8, 2), (12, 0)],
+        'profiles': [(3, 'renamed', 'Новое имя', 0, None), (7, 'user7', 'Name7', 0, 'VIP7'),
+                     (8, 'user8', 'Name8', 2, None)],
+    }
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_scheduled_messages(engine, tmp_path):
+    result = _run(engine, tmp_path, _scheduled)
+    assert result['unique_ids']
+    assert result['pending'] == sorted((user_id, stage, f"user{user_id}")
+                                       for user_id in (1, 2, 3, 4, 5) for stage in (1, 2))
+    assert result['after_mark'] == [(user_id, 2, f"user{user_id}") for user_id in (1, 2, 3, 4, 5)]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_campaigns(engine, tmp_path):
+    result = _run(engine, tmp_path, _campaigns)
+    assert result == {
+        'ids': (1, 2),
+        'first': (1, "Исправлено", None, "https://b", "Новая кнопка", 6),
+        'second': (2, "Фото", "https://img", None, None, 0),
+        'missing': None,
+        'pages': [[(1, 10), (2, 20)], [(5, 50), (12, 120)]],
+        'other': [(3, 30)],
+    }
+
+
+def test_sharded_pending_merges_by_time_and_decodes_ids(tmp_path):
+    async def scenario(storage):
+        for user_id in range(1, 7):
+            await storage.add_subscriber(user_id, f"user{user_id}", "Name")
+            await storage.add_scheduled_message(user_id, 1, 0)
+        # Разносим время отправки так, чтобы порядок чередовал шарды
+        for shard_no in range(3):
+            db = sqlite3.connect(str(tmp_path / f'subscribers.{shard_no}.db'))
+            db.execute("UPDATE scheduled_messages SET scheduled_for = "
+                       "datetime('now', '-' || (100 - user_id) || ' minutes')")
+            db.commit()
+            db.close()
+
+        pending = await storage.get_pending_messages()
+        await storage.mark_message_sent(pending[2][0])
+        return pending, await storage.get_pending_messages()
+
+    pending, after_mark = _run("sharded", tmp_path, scenario)
+    assert [row[1] for row in pending] == [1, 2, 3, 4, 5, 6]
+    assert [row[0] % 3 for row in pending] == [1, 2, 0, 1, 2, 0]
+    assert [row[1] for row in after_mark] == [1, 2, 4, 5, 6]
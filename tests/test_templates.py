@@ -0,0 +1,63 @@
+import pytest
+
+from services.templates import FIELD_MAX_LENGTHS, TemplateError, _visible_length, compile_template
+
+
+def test_render_escapes_and_uses_defaults():
+    template = compile_template("Привет, <b>{first_name|друг}</b>!")
+    assert template.render({'first_name': '<Анна>'}) == "Привет, <b>&lt;Анна&gt;</b>!"
+    assert template.render({'first_name': ''}) == "Привет, <b>друг</b>!"
+    assert template.render() == "Привет, <b>друг</b>!"
+
+
+@pytest.mark.parametrize("field, value", [
+    ('promo_code', 'X' * 5000),
+    ('first_name', 'Я' * 200),
+    ('first_name', '😀' * 70),
+    ('username', 'u' * 33),
+])
+def test_render_clips_fields_to_limit(field, value):
+    template = compile_template(f"{{{field}}}", cache_size=0)
+    rendered = template.render({field: value})
+    assert _visible_length(rendered) <= FIELD_MAX_LENGTHS[field]
+    assert value.startswith(rendered)
+
+
+def test_worst_case_fits_telegram_limit():
+    # Все поля максимальной длины: при рендере текст не длиннее, чем посчитано при компиляции
+    text = "a" * (1024 - sum(FIELD_MAX_LENGTHS.values()) - 4) + " {first_name} {username} {stage} {promo_code}"
+    template = compile_template(text, caption=True)
+    rendered = template.render({'first_name': '😀' * 100, 'username': 'u' * 100,
+                                'stage': 123456, 'promo_code': 'P' * 100})
+    assert _visible_length(rendered) <= 1024
+    with pytest.raises(TemplateError):
+        compile_template("a" + text, caption=True)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("{first_name|Привет!}", "Привет!"),
+    ("{first_name|Время: 10:00}", "Время: 10:00"),
+    ("{first_name|a|b}", "a|b"),
+    ("{{first_name}} {first_name|}", "{first_name} "),
+    ("}} {{", "} {"),
+])
+def test_defaults_and_literal_braces(text, expected):
+    assert compile_template(text).render() == expected
+
+
+@pytest.mark.parametrize("text, message", [
+    ("{first_name!r}", "Форматирование полей не поддерживается"),
+    ("{first_name:>10}", "Форматирование полей не поддерживается"),
+    ("{first_name", "незакрытая скобка"),
+    ("first_name}", "непарная скобка"),
+    ("{|друг}", "Пустое имя поля"),
+    ("{last_name}", "Неизвестное поле"),
+])
+def test_invalid_templates(text, message):
+    with pytest.raises(TemplateError, match=message):
+        compile_template(text)
+
+
+def test_welcome_templates_compile():
+    from services.welcome import WELCOME_TEMPLATES
+    assert WELCOME_TEMPLATES[0].render({'first_name': 'Анна'}).startswith("👋 Анна, ")